@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class DataManagementConfig(AppConfig):
     name = 'data_management'
+
+    def ready(self):
+        # Connect the signal handlers that track changes to the registry tables
+        from . import generations  # noqa: F401
+        from . import lineage  # noqa: F401
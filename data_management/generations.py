@@ -0,0 +1,148 @@
+from functools import wraps
+from hashlib import sha1
+import time
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, set_response_etag
+from django.views.decorators.cache import cache_page
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import models
+
+
+def _generation_key(model):
+    return 'generation:%s' % model._meta.label_lower
+
+
+def _new_generation():
+    # Generations start from the current time so that a generation lost from the cache is never reused
+    return int(time.time() * 1000)
+
+
+def _changed_key(model):
+    return 'changed:%s' % model._meta.label_lower
+
+
+def _increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_generation(), None)
+
+
+def _changed(model):
+    _increment(_generation_key(model))
+    cache.set(_changed_key(model), time.time(), None)
+
+
+def get_generations(model_list):
+    """
+    Return the current generation of each of the given models.
+
+    The generation of a model changes every time a row in the model's table, or one of its many-to-many relations, is
+    added, changed or deleted so it can be used in cache keys for data derived from the table.
+    """
+    keys = [_generation_key(model) for model in model_list]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, _new_generation(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def get_generation(model):
+    """
+    Return the current generation of the given model.
+    """
+    return get_generations([model])[0]
+
+
+def get_last_changed(model_list):
+    """
+    Return the time (as a timestamp) that any of the given models last changed.
+
+    If the change time of a model is not known it is taken to be now, so the result is never earlier than the real
+    time of the last change.
+    """
+    keys = [_changed_key(model) for model in model_list]
+    changed = cache.get_many(keys)
+    for key in keys:
+        if key not in changed:
+            cache.add(key, time.time(), None)
+            changed[key] = cache.get(key)
+    return max(changed.values())
+
+
+def related_models(model, depth=1):
+    """
+    Return the given model along with all the registry models it is related to, either directly or, for `depth`
+    greater than one, through up to `depth` relations.
+    """
+    related = [model]
+    for field in model._meta.get_fields():
+        if field.is_relation and field.related_model in models.all_models.values():
+            nested = related_models(field.related_model, depth - 1) if depth > 1 else [field.related_model]
+            related.extend(m for m in nested if m not in related)
+    return related
+
+
+def bump_generation(model):
+    """
+    Move the given model on to a new generation and record the time it changed.
+
+    The generation is bumped immediately, so the change is seen by later queries in the same transaction, and again
+    when the transaction commits so that nothing cached by another request before the commit is used afterwards.
+    """
+    _changed(model)
+    transaction.on_commit(lambda: _changed(model))
+
+
+def generation_cache_page(timeout, model_list):
+    """
+    Decorator caching the responses of a view like `cache_page`, but with the generations of the given models in
+    the cache key so that the cached responses are no longer used as soon as any of the models change. This means
+    that the responses can be cached for much longer without showing out of date data.
+
+    Clients are not told to cache the responses, as they cannot see when the models change. Instead the responses
+    carry an ETag so that clients can revalidate them cheaply.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped_view(request, *args, **kwargs):
+            key_prefix = 'generation-%s' % sha1(repr(get_generations(model_list)).encode('utf-8')).hexdigest()
+            response = cache_page(timeout, key_prefix=key_prefix)(view)(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                # Rendering runs the cache middleware, which would otherwise add its headers after ours
+                response.render()
+            if response.streaming or response.status_code != 200:
+                return response
+            del response['Expires']
+            patch_cache_control(response, no_cache=True, max_age=0)
+            if not response.has_header('ETag'):
+                set_response_etag(response)
+            return get_conditional_response(request, etag=response['ETag'], response=response)
+        return wrapped_view
+    return decorator
+
+
+def _is_registry_model(model):
+    return model in models.all_models.values()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def _model_changed(sender, **kwargs):
+    if _is_registry_model(sender):
+        bump_generation(sender)
+
+
+@receiver(m2m_changed)
+def _relation_changed(sender, instance, action, model, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    for changed in (type(instance), model):
+        if _is_registry_model(changed):
+            bump_generation(changed)
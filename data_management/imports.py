@@ -0,0 +1,166 @@
+import codecs
+import csv
+from datetime import timedelta
+import json
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import camel_case_to_spaces
+
+from data_management import models
+from data_management.rest.serializers import get_serializer_class
+from data_management.upsert import unique_violation
+
+# Number of rows imported in each transaction, the progress of the job is saved after each batch
+BATCH_SIZE = 500
+
+# Maximum number of row errors recorded for a job, any further errors are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# Time after which a running job whose worker has not saved its progress is taken to have been abandoned, and can be
+# claimed by another worker to carry on from the last batch saved
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+
+# Models that can be imported, by the name of their API endpoint
+RECORD_TYPES = dict(
+    (camel_case_to_spaces(name).replace(' ', '_'), cls) for (name, cls) in models.all_models.items()
+)
+
+
+class RowError(Exception):
+    """
+    Error raised when a row of an import file cannot be imported, with the errors to report for the row in the same
+    form as the errors returned by the API.
+    """
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def create_job(user, file_name, file, file_format=None, record_type=''):
+    """
+    Queue an ImportJob for the records in `file`, a Django File (e.g. an uploaded file) which is copied to the media
+    storage in chunks. The format of the file is taken from its extension if not given.
+    """
+    if file_format is None:
+        file_format = models.ImportJob.CSV if file_name.lower().endswith('.csv') else models.ImportJob.JSONL
+    job = models.ImportJob(created_by=user, file_name=file_name, file_format=file_format, record_type=record_type)
+    job.file.save(file_name, file, save=False)
+    job.save()
+    return job
+
+
+def claim_job():
+    """
+    Mark the oldest pending ImportJob as running and return it, or return None if there are no pending jobs. Running
+    jobs whose worker has not saved any progress for STALE_JOB_TIMEOUT are claimed again as if they were pending. The
+    job is claimed with the row locked so that each job is only processed by one worker.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        stale = Q(status=models.ImportJob.RUNNING, heartbeat__lt=now - STALE_JOB_TIMEOUT)
+        job = models.ImportJob.objects.select_for_update(skip_locked=True) \
+            .filter(Q(status=models.ImportJob.PENDING) | stale).order_by('id').first()
+        if job is not None:
+            job.status = models.ImportJob.RUNNING
+            job.started = job.started or now
+            job.heartbeat = now
+            job.save(update_fields=['status', 'started', 'heartbeat'])
+    return job
+
+
+def read_records(job):
+    """
+    Generate the row number and record for each row of the job's file, where the record is a dict of field values or a
+    RowError if the row could not be read. Rows of a CSV file are numbered from the first row after the header. The
+    file is read a line at a time, so is never held in memory.
+    """
+    with job.file.open('rb') as f:
+        lines = codecs.getreader('utf-8')(f)
+        if job.file_format == models.ImportJob.CSV:
+            for row, record in enumerate(csv.DictReader(lines), 1):
+                yield row, dict((name, value) for (name, value) in record.items() if value != '')
+            return
+        for row, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as ex:
+                record = RowError({'non_field_errors': ['Invalid JSON: %s' % ex]})
+            if not isinstance(record, (dict, RowError)):
+                record = RowError({'non_field_errors': ['Each line must be a JSON object']})
+            yield row, record
+
+
+def batches(items, size):
+    """
+    Generate lists of up to `size` items from an iterable.
+    """
+    items = iter(items)
+    batch = list(islice(items, size))
+    while batch:
+        yield batch
+        batch = list(islice(items, size))
+
+
+def import_record(record, user, default_type=''):
+    """
+    Create the registry object described by a record, which gives the `type` of the object as the name of its API
+    endpoint (e.g. `storage_root`), unless a default type is given, and its fields as they would be POSTed to the API.
+    Raises a RowError if the object cannot be created.
+    """
+    if isinstance(record, RowError):
+        raise record
+    record = dict(record)
+    record_type = record.pop('type', None) or default_type
+    model = RECORD_TYPES.get(record_type)
+    if model is None:
+        raise RowError({'type': ['Invalid type %s' % record_type]})
+    if model is models.Issue:
+        record.setdefault('object_issues', [])
+        record.setdefault('component_issues', [])
+    serializer = get_serializer_class(model)(data=record)
+    if not serializer.is_valid():
+        raise RowError(serializer.errors)
+    try:
+        with transaction.atomic():
+            return serializer.save(updated_by=user)
+    except IntegrityError as ex:
+        name = unique_violation(model, ex)
+        raise RowError({'detail': 'Field %s must be unique' % name if name is not None else str(ex)})
+
+
+def process_job(job):
+    """
+    Import the records of a claimed ImportJob, in batches of BATCH_SIZE rows which are each imported in a single
+    transaction. Rows that cannot be imported are skipped and their errors recorded. The progress of the job is saved
+    with each batch so that it can be followed while the job runs, and so that a job claimed again after its worker
+    stopped carries on after the last batch saved. The file is deleted once the job is complete.
+    """
+    try:
+        records = islice(read_records(job), job.rows_processed, None)
+        for batch in batches(records, BATCH_SIZE):
+            errors = []
+            with transaction.atomic():
+                for row, record in batch:
+                    try:
+                        import_record(record, job.created_by, job.record_type)
+                    except RowError as ex:
+                        errors.append(models.ImportJobError(job=job, row=row, detail=json.dumps(ex.detail)))
+                models.ImportJobError.objects.bulk_create(errors[:max(0, MAX_REPORTED_ERRORS - job.rows_failed)])
+                job.rows_processed += len(batch)
+                job.rows_failed += len(errors)
+                job.heartbeat = timezone.now()
+                job.save(update_fields=['rows_processed', 'rows_failed', 'heartbeat'])
+    except Exception as ex:
+        job.status = models.ImportJob.FAILED
+        job.message = '%s: %s' % (type(ex).__name__, ex)
+    else:
+        job.status = models.ImportJob.COMPLETE
+        job.file.delete(save=False)
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'message', 'finished', 'file'])
+    return job
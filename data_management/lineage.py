@@ -0,0 +1,402 @@
+from collections import defaultdict
+from functools import reduce
+from itertools import islice
+import operator
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import models
+
+OBJECT = models.LineageLink.OBJECT
+CODE_RUN = models.LineageLink.CODE_RUN
+
+INPUTS = models.CodeRun.inputs.through
+OUTPUTS = models.CodeRun.outputs.through
+
+# Number of rows of the lineage table inserted at a time
+BATCH_SIZE = 1000
+
+# Key of the PostgreSQL advisory lock held while the lineage table is changed
+LOCK_KEY = 0x6c696e65
+
+
+def _lock():
+    """
+    Take the lock serialising changes to the lineage table, which is held until the end of the current transaction.
+
+    Each change is worked out from the lineage that the transaction can see, so without the lock two transactions
+    adding the edges A -> B and B -> C at the same time would each miss the link between A and C. The lock is only
+    taken on PostgreSQL; on other databases concurrent changes can leave links out, and `rebuild_lineage` should be
+    run periodically.
+    """
+    connection = transaction.get_connection()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_KEY])
+
+
+def _node_filter(nodes, role):
+    """
+    Return a Q object matching the rows of the lineage table with any of the given (type, id) nodes as the ancestor or
+    descendant, as given by `role`.
+    """
+    ids = defaultdict(set)
+    for node_type, node_id in nodes:
+        ids[node_type].add(node_id)
+    return reduce(operator.or_, (
+        Q(**{role + '_type': node_type, role + '_id__in': node_ids}) for node_type, node_ids in ids.items()
+    ))
+
+
+def _closure(nodes, role):
+    """
+    Return a dict of the ancestors (role `descendant`) or descendants (role `ancestor`) of each of the nodes, as
+    recorded in the lineage table.
+    """
+    other = 'ancestor' if role == 'descendant' else 'descendant'
+    closure = defaultdict(set)
+    if nodes:
+        rows = models.LineageLink.objects.filter(_node_filter(nodes, role)).values_list(
+            role + '_type', role + '_id', other + '_type', other + '_id')
+        for node_type, node_id, other_type, other_id in rows:
+            closure[(node_type, node_id)].add((other_type, other_id))
+    return closure
+
+
+def get_lineage(node_type, node_id, role):
+    """
+    Return the ancestors (role `descendant`) or descendants (role `ancestor`) of an Object or CodeRun as a dict of the
+    sorted list of ids of each type of node, using a single query of the lineage table.
+    """
+    other = 'ancestor' if role == 'descendant' else 'descendant'
+    rows = models.LineageLink.objects.filter(**{role + '_type': node_type, role + '_id': node_id}) \
+        .order_by(other + '_type', other + '_id').values_list(other + '_type', other + '_id')
+    lineage = {OBJECT: [], CODE_RUN: []}
+    for other_type, other_id in rows:
+        lineage[other_type].append(other_id)
+    return lineage
+
+
+# Node type of ObjectComponents in the impact of issues, which are not nodes of the lineage table
+OBJECT_COMPONENT = 'object_component'
+
+
+class Impact:
+    """
+    The CodeRuns, Objects and ObjectComponents downstream of Objects and ObjectComponents with issues, along with the
+    maximum severity of the issues affecting each of them, as (node type, id, severity) tuples in order of decreasing
+    severity, then by type and id.
+
+    The CodeRuns affected are those which used an ObjectComponent with an issue as an input, and everything descending
+    from those runs or from the Objects with issues in the lineage table. As the lineage table links Objects rather than
+    their components, any run which used any component of an affected Object is affected, so the impact is only precise
+    to the component for the runs using the components with issues. The ObjectComponents affected are the outputs of
+    the affected runs.
+
+    The impact is computed by the database with a single query for each slice taken, grouping the affected nodes to
+    find their maximum severity, so it can be paginated without loading the nodes of the other pages.
+    """
+    def __init__(self, objects, components):
+        """
+        :param objects: Dict of the severity of the issues with each Object, by Object id
+        :param components: Dict of the severity of the issues with each ObjectComponent, by ObjectComponent id
+        """
+        self.roots = [(OBJECT, object_id, severity) for object_id, severity in objects.items()] + \
+            [(OBJECT_COMPONENT, component_id, severity) for component_id, severity in components.items()]
+
+    def _query(self, select, tail=''):
+        """
+        Return the SQL and parameters for a query on the impact, which is available to `select` as the table `impact`
+        with columns `node_type`, `node_id` and `severity`.
+        """
+        link = models.LineageLink._meta.db_table
+        sql = """
+            WITH roots (node_type, node_id, severity) AS (VALUES %(roots)s),
+            seeds AS (
+                SELECT node_type, node_id, severity FROM roots WHERE node_type = %%s
+                UNION ALL
+                SELECT %%s, inputs.%(run)s, roots.severity
+                FROM roots JOIN %(inputs)s inputs ON inputs.%(component)s = roots.node_id
+                WHERE roots.node_type = %%s
+            ),
+            reached AS (
+                SELECT node_type, node_id, severity FROM seeds WHERE node_type = %%s
+                UNION ALL
+                SELECT link.descendant_type, link.descendant_id, seeds.severity
+                FROM seeds JOIN %(link)s link
+                ON link.ancestor_type = seeds.node_type AND link.ancestor_id = seeds.node_id
+            ),
+            nodes AS (
+                SELECT node_type, node_id, MAX(severity) AS severity FROM reached GROUP BY node_type, node_id
+            ),
+            impact AS (
+                SELECT node_type, node_id, severity FROM nodes
+                UNION ALL
+                SELECT %%s, outputs.%(component)s, MAX(nodes.severity)
+                FROM nodes JOIN %(outputs)s outputs ON outputs.%(run)s = nodes.node_id
+                WHERE nodes.node_type = %%s
+                GROUP BY outputs.%(component)s
+            )
+            %(select)s %(tail)s
+        """ % {
+            'roots': ', '.join(['(%s, %s, %s)'] * len(self.roots)),
+            'link': link,
+            'inputs': INPUTS._meta.db_table,
+            'outputs': OUTPUTS._meta.db_table,
+            'run': INPUTS._meta.get_field('coderun').column,
+            'component': INPUTS._meta.get_field('objectcomponent').column,
+            'select': select,
+            'tail': tail,
+        }
+        params = [value for root in self.roots for value in root]
+        params += [OBJECT, CODE_RUN, OBJECT_COMPONENT, CODE_RUN, OBJECT_COMPONENT, CODE_RUN]
+        return sql, params
+
+    def _fetch(self, select, tail='', extra_params=()):
+        sql, params = self._query(select, tail)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + list(extra_params))
+            return cursor.fetchall()
+
+    def count(self):
+        if not self.roots:
+            return 0
+        return self._fetch('SELECT COUNT(*) FROM impact')[0][0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('Impact only supports slices')
+        start = index.start or 0
+        if not self.roots or (index.stop is not None and index.stop <= start):
+            return []
+        stop = index.stop if index.stop is not None else start + self.count()
+        return [tuple(row) for row in self._fetch(
+            'SELECT node_type, node_id, severity FROM impact',
+            'ORDER BY severity DESC, node_type, node_id LIMIT %s OFFSET %s', [stop - start, start])]
+
+
+def get_impact(objects, components):
+    """
+    Return the Impact of issues with the given Objects and ObjectComponents, which can be sliced and counted like a
+    queryset.
+
+    :param objects: Dict of the severity of the issues with each Object, by Object id
+    :param components: Dict of the severity of the issues with each ObjectComponent, by ObjectComponent id
+    """
+    return Impact(objects, components)
+
+
+def _parents(nodes=None):
+    """
+    Return a dict of the parents of each of the given nodes, or of all nodes if None, from the inputs and outputs of the
+    CodeRuns. The parents of a CodeRun are the Objects of its inputs and the parents of an Object are the CodeRuns
+    which output its components.
+    """
+    inputs = INPUTS.objects.all()
+    outputs = OUTPUTS.objects.all()
+    if nodes is not None:
+        inputs = inputs.filter(coderun_id__in=[node_id for node_type, node_id in nodes if node_type == CODE_RUN])
+        outputs = outputs.filter(
+            objectcomponent__object_id__in=[node_id for node_type, node_id in nodes if node_type == OBJECT])
+    parents = defaultdict(set)
+    for run_id, object_id in inputs.values_list('coderun_id', 'objectcomponent__object_id'):
+        parents[(CODE_RUN, run_id)].add((OBJECT, object_id))
+    for object_id, run_id in outputs.values_list('objectcomponent__object_id', 'coderun_id'):
+        parents[(OBJECT, object_id)].add((CODE_RUN, run_id))
+    return parents
+
+
+def _compute_ancestors(nodes, parents, known):
+    """
+    Compute the ancestors of each of the nodes from their parents, using the `known` ancestors of any parents which are
+    not themselves in `nodes`.
+
+    The nodes are visited with parents before their children so that a single pass is enough, unless there are cycles
+    in which case the nodes in the cycles are visited repeatedly until their ancestors stop changing.
+    """
+    children = defaultdict(list)
+    waiting = {}
+    for node in nodes:
+        inside = [parent for parent in parents.get(node, ()) if parent in nodes]
+        waiting[node] = len(inside)
+        for parent in inside:
+            children[parent].append(node)
+    order = [node for node in nodes if waiting[node] == 0]
+    for node in order:
+        for child in children[node]:
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                order.append(child)
+    acyclic = len(order) == len(nodes)
+    ordered = set(order)
+    order.extend(node for node in nodes if node not in ordered)
+
+    ancestors = dict((node, set()) for node in nodes)
+    changed = True
+    while changed:
+        changed = False
+        for node in order:
+            result = set()
+            for parent in parents.get(node, ()):
+                result.add(parent)
+                result |= ancestors[parent] if parent in ancestors else known.get(parent, set())
+            result.discard(node)
+            if result != ancestors[node]:
+                ancestors[node] = result
+                changed = not acyclic
+    return ancestors
+
+
+def _insert(pairs):
+    """
+    Insert rows into the lineage table for the (ancestor, descendant) pairs, ignoring any which already exist.
+    """
+    rows = (
+        models.LineageLink(ancestor_type=ancestor[0], ancestor_id=ancestor[1],
+                           descendant_type=descendant[0], descendant_id=descendant[1])
+        for ancestor, descendant in pairs
+    )
+    batch = list(islice(rows, BATCH_SIZE))
+    while batch:
+        models.LineageLink.objects.bulk_create(batch, ignore_conflicts=True)
+        batch = list(islice(rows, BATCH_SIZE))
+
+
+def _rebuild_ancestors(nodes):
+    """
+    Recompute the ancestors of the given nodes, which must include every descendant of any node in the set.
+    """
+    nodes = set(nodes)
+    if not nodes:
+        return
+    with transaction.atomic():
+        _lock()
+        models.LineageLink.objects.filter(_node_filter(nodes, 'descendant')).delete()
+        parents = _parents(nodes)
+        known = _closure({parent for node in nodes for parent in parents[node] if parent not in nodes}, 'descendant')
+        ancestors = _compute_ancestors(nodes, parents, known)
+        _insert((ancestor, node) for node in nodes for ancestor in ancestors[node])
+
+
+def rebuild_lineage():
+    """
+    Rebuild the whole lineage table from the inputs and outputs of all the CodeRuns.
+    """
+    with transaction.atomic():
+        _lock()
+        models.LineageLink.objects.all().delete()
+        parents = _parents()
+        nodes = set(parents).union(*parents.values())
+        ancestors = _compute_ancestors(nodes, parents, {})
+        _insert((ancestor, node) for node in nodes for ancestor in ancestors[node])
+
+
+def _edges(through, links):
+    """
+    Return the edges of the lineage graph given by (code run id, component id) links in the inputs or outputs of
+    CodeRuns, as (parent, child) pairs.
+    """
+    if not links:
+        return set()
+    objects = dict(models.ObjectComponent.objects.filter(pk__in={component_id for _, component_id in links})
+                   .values_list('pk', 'object_id'))
+    if through is INPUTS:
+        return {((OBJECT, objects[component_id]), (CODE_RUN, run_id)) for run_id, component_id in links}
+    return {((CODE_RUN, run_id), (OBJECT, objects[component_id])) for run_id, component_id in links}
+
+
+def add_links(through, links):
+    """
+    Update the lineage table for new (code run id, component id) links in the inputs or outputs of CodeRuns, given by
+    the through model of the relation. Every ancestor of the parent of each new edge, and the parent itself, becomes
+    an ancestor of every descendant of the child, and of the child itself.
+    """
+    edges = _edges(through, links)
+    if not edges:
+        return
+    with transaction.atomic():
+        _lock()
+        known = _closure({parent for parent, _ in edges}, 'descendant')
+        descendants = _closure({child for _, child in edges}, 'ancestor')
+        pairs = set()
+        for parent, child in edges:
+            for descendant in descendants[child] | {child}:
+                pairs.update((ancestor, descendant) for ancestor in known[parent] | {parent} if ancestor != descendant)
+        _insert(pairs)
+
+
+def links_created(through, rows):
+    """
+    Update the lineage table for rows bulk inserted into a many-to-many through table, which do not send the
+    m2m_changed signal. Rows of other relations than the inputs and outputs of CodeRuns are ignored.
+    """
+    if through in (INPUTS, OUTPUTS):
+        add_links(through, [(row.coderun_id, row.objectcomponent_id) for row in rows])
+
+
+def _affected_by_runs(run_ids):
+    """
+    Return the nodes whose ancestors may change if the inputs or outputs of the CodeRuns change.
+    """
+    runs = {(CODE_RUN, run_id) for run_id in run_ids}
+    return runs.union(*_closure(runs, 'ancestor').values())
+
+
+@receiver(m2m_changed, sender=INPUTS)
+@receiver(m2m_changed, sender=OUTPUTS)
+def _links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        if reverse:
+            add_links(sender, [(run_id, instance.pk) for run_id in pk_set])
+        else:
+            add_links(sender, [(instance.pk, component_id) for component_id in pk_set])
+    elif action in ('pre_remove', 'pre_clear'):
+        if not reverse:
+            run_ids = {instance.pk}
+        elif pk_set is not None:
+            run_ids = pk_set
+        else:
+            run_ids = set(sender.objects.filter(objectcomponent_id=instance.pk).values_list('coderun_id', flat=True))
+        # The changed links are only known before they are removed, so the nodes to update are found now, with the
+        # lock held until the removal commits
+        _lock()
+        instance._lineage_affected = _affected_by_runs(run_ids)
+    elif action in ('post_remove', 'post_clear'):
+        _rebuild_ancestors(getattr(instance, '_lineage_affected', ()))
+
+
+def _deleted_node(instance):
+    """
+    Return the node whose links change when the instance is deleted, which for an ObjectComponent is its Object.
+    """
+    if isinstance(instance, models.CodeRun):
+        return CODE_RUN, instance.pk
+    if isinstance(instance, models.ObjectComponent):
+        return OBJECT, instance.object_id
+    return OBJECT, instance.pk
+
+
+@receiver(pre_delete, sender=models.CodeRun)
+@receiver(pre_delete, sender=models.Object)
+@receiver(pre_delete, sender=models.ObjectComponent)
+def _node_deleting(sender, instance, **kwargs):
+    _lock()
+    node = _deleted_node(instance)
+    instance._lineage_affected = {node}.union(*_closure({node}, 'ancestor').values())
+
+
+@receiver(post_delete, sender=models.CodeRun)
+@receiver(post_delete, sender=models.Object)
+@receiver(post_delete, sender=models.ObjectComponent)
+def _node_deleted(sender, instance, **kwargs):
+    affected = getattr(instance, '_lineage_affected', set())
+    _lock()
+    if sender is not models.ObjectComponent:
+        node = _deleted_node(instance)
+        links = _node_filter({node}, 'ancestor') | _node_filter({node}, 'descendant')
+        models.LineageLink.objects.filter(links).delete()
+        affected.discard(node)
+    _rebuild_ancestors(affected)
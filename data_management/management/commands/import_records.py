@@ -0,0 +1,35 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from data_management import models
+from data_management.imports import RECORD_TYPES, create_job
+
+
+class Command(BaseCommand):
+    help = 'Queue a JSON lines or CSV file of registry records to be imported by the process_imports command'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='File of records to import')
+        parser.add_argument('--user', required=True, help='Username of the user importing the records')
+        parser.add_argument('--type', default='', help='Type of any records which do not give their own type')
+        parser.add_argument('--format', choices=[models.ImportJob.JSONL, models.ImportJob.CSV],
+                            help='Format of the file, by default taken from the file extension')
+        parser.add_argument('--now', action='store_true',
+                            help='Process the queued imports now rather than leaving them to a worker')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('User %s does not exist' % options['user'])
+        if options['type'] and options['type'] not in RECORD_TYPES:
+            raise CommandError('Invalid type %s' % options['type'])
+        with open(options['file'], 'rb') as f:
+            job = create_job(user, os.path.basename(options['file']), File(f), options['format'], options['type'])
+        self.stdout.write('Queued import %d' % job.pk)
+        if options['now']:
+            call_command('process_imports', once=True, stdout=self.stdout)
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from data_management.imports import claim_job, process_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued imports of registry records, polling for new imports until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once there are no queued imports')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Time in seconds to wait before checking for new imports again')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+            self.stdout.write('Processing import %d' % job.pk)
+            job = process_job(job)
+            self.stdout.write('Import %d %s: %d rows processed, %d failed' % (
+                job.pk, job.status, job.rows_processed, job.rows_failed))
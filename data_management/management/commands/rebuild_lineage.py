@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from data_management import models
+from data_management.lineage import rebuild_lineage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the lineage table of Objects and CodeRuns from the inputs and outputs of all the CodeRuns'
+
+    def handle(self, *args, **options):
+        rebuild_lineage()
+        self.stdout.write('Lineage rebuilt with %d links' % models.LineageLink.objects.count())
@@ -1,6 +1,7 @@
 from django.contrib.sites.shortcuts import get_current_site
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from dynamic_validator import ModelFieldRequiredMixin
 from django.contrib.auth import get_user_model
 
@@ -30,6 +31,7 @@ class BaseModel(ModelFieldRequiredMixin, models.Model):
     REQUIRED_FIELDS = ()
     FILTERSET_FIELDS = '__all__'
     ADMIN_LIST_FIELDS = ()
+    ORDERING_FIELDS = ('id', 'last_updated')
 
     def reverse_name(self):
         return self.__class__.__name__.lower()
@@ -110,6 +112,11 @@ class Issue(BaseModel):
     severity = models.PositiveSmallIntegerField(default=1)
     description = models.TextField(max_length=TEXT_FIELD_LENGTH, null=False, blank=False)
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
+
     def short_desc(self):
         if self.description is None:
             return ''
@@ -174,6 +181,11 @@ class Object(BaseModel):
                                             related_name='location_for_object')
     description = models.TextField(max_length=TEXT_FIELD_LENGTH, null=True, blank=True)
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
+
     def name(self):
         if self.storage_location:
             return str(self.storage_location)
@@ -237,6 +249,7 @@ class ObjectComponent(BaseModel):
     """
     ADMIN_LIST_FIELDS = ('object', 'name')
     EXTRA_DISPLAY_FIELDS = ('inputs_of', 'outputs_of')
+    ORDERING_FIELDS = ('id', 'last_updated', 'name')
 
     object = models.ForeignKey(Object, on_delete=models.CASCADE, related_name='components', null=False)
     name = NameField(null=False, blank=False)
@@ -249,6 +262,10 @@ class ObjectComponent(BaseModel):
                 fields=('object', 'name'),
                 name='unique_object_component'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('name', 'id')),
+        ]
 
     def __str__(self):
         return self.name
@@ -282,6 +299,7 @@ class CodeRun(BaseModel):
     """
     EXTRA_DISPLAY_FIELDS = ('prov_report',)
     ADMIN_LIST_FIELDS = ('description',)
+    ORDERING_FIELDS = ('id', 'last_updated', 'run_date')
 
     code_repo = models.ForeignKey(Object, on_delete=models.CASCADE, related_name='code_repo_of', null=True, blank=True)
     model_config = models.ForeignKey(Object, on_delete=models.CASCADE, related_name='config_of', null=True, blank=True)
@@ -291,6 +309,12 @@ class CodeRun(BaseModel):
     inputs = models.ManyToManyField(ObjectComponent, related_name='inputs_of', blank=True)
     outputs = models.ManyToManyField(ObjectComponent, related_name='outputs_of', blank=True)
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('run_date', 'id')),
+        ]
+
     def prov_report(self):
         url = reverse('prov_report', kwargs={'pk': self.id})
         full_url = ''.join(['http://', get_current_site(None).domain, url])
@@ -336,6 +360,7 @@ class StorageRoot(BaseModel):
     """
     EXTRA_DISPLAY_FIELDS = ('locations',)
     ADMIN_LIST_FIELDS = ('name',)
+    ORDERING_FIELDS = ('id', 'last_updated', 'name')
 
     PUBLIC = 0
     PRIVATE = 1
@@ -353,6 +378,10 @@ class StorageRoot(BaseModel):
                 fields=('name',),
                 name='unique_storage_root'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('name', 'id')),
+        ]
 
     def is_public(self):
         return self.accessibility == self.PUBLIC
@@ -395,6 +424,9 @@ class StorageLocation(BaseModel):
                 fields=('storage_root', 'path', 'hash'),
                 name='unique_storage_location'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
 
     def full_uri(self):
         return self.storage_root.root + self.path
@@ -422,6 +454,7 @@ class Source(BaseModel):
     `updated_by`: Reference to the user that updated this record
     """
     ADMIN_LIST_FIELDS = ('name',)
+    ORDERING_FIELDS = ('id', 'last_updated', 'name')
 
     name = NameField(null=False, blank=False)
     abbreviation = models.CharField(max_length=CHAR_FIELD_LENGTH, null=False, blank=False)
@@ -433,6 +466,10 @@ class Source(BaseModel):
                 fields=('name',),
                 name='unique_source'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('name', 'id')),
+        ]
 
     def __str__(self):
         return self.name
@@ -472,6 +509,7 @@ class ExternalObject(BaseModel):
     `updated_by`: Reference to the user that updated this record
     """
     ADMIN_LIST_FIELDS = ('doi_or_unique_name', 'title', 'version')
+    ORDERING_FIELDS = ('id', 'last_updated', 'release_date')
 
     object = models.OneToOneField(Object, on_delete=models.CASCADE, related_name='external_object')
     doi_or_unique_name = models.CharField(max_length=CHAR_FIELD_LENGTH, null=False, blank=False)
@@ -489,6 +527,10 @@ class ExternalObject(BaseModel):
                 fields=('doi_or_unique_name', 'title', 'version'),
                 name='unique_external_object'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('release_date', 'id')),
+        ]
 
     def __str__(self):
         return '%s %s version %s' % (self.doi_or_unique_name, self.title, self.version)
@@ -512,6 +554,11 @@ class QualityControlled(BaseModel):
 
     object = models.OneToOneField(Object, on_delete=models.CASCADE, related_name='quality_control')
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
+
 
 class Keyword(BaseModel):
     """
@@ -541,6 +588,9 @@ class Keyword(BaseModel):
                 fields=('object', 'keyphrase'),
                 name='unique_keyword'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
 
     def __str__(self):
         return self.keyphrase
@@ -571,6 +621,11 @@ class Author(BaseModel):
     family_name = NameField(null=False, blank=False)
     personal_name = NameField(null=False, blank=False)
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
+
     def __str__(self):
         return '%s, %s' % (self.family_name, self.personal_name)
 
@@ -597,6 +652,11 @@ class Licence(BaseModel):
     object = models.ForeignKey(Object, on_delete=models.CASCADE, related_name='licences')
     licence_info = models.TextField()
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
+
 
 class Namespace(BaseModel):
     """
@@ -613,6 +673,7 @@ class Namespace(BaseModel):
     `updated_by`: Reference to the user that updated this record
     """
     ADMIN_LIST_FIELDS = ('name',)
+    ORDERING_FIELDS = ('id', 'last_updated', 'name')
 
     name = NameField(null=False, blank=False)
 
@@ -622,6 +683,10 @@ class Namespace(BaseModel):
                 fields=('name',),
                 name='unique_namespace'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('name', 'id')),
+        ]
 
     def __str__(self):
         return self.name
@@ -648,6 +713,7 @@ class DataProduct(BaseModel):
     `updated_by`: Reference to the user that updated this record
     """
     ADMIN_LIST_FIELDS = ('namespace', 'name', 'version')
+    ORDERING_FIELDS = ('id', 'last_updated', 'name')
 
     object = models.OneToOneField(Object, on_delete=models.CASCADE, related_name='data_product')
     namespace = models.ForeignKey(Namespace, on_delete=models.CASCADE, related_name='data_products')
@@ -660,6 +726,10 @@ class DataProduct(BaseModel):
                 fields=('namespace', 'name', 'version'),
                 name='unique_data_product'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('name', 'id')),
+        ]
 
     def __str__(self):
         return '%s:%s version %s' % (self.namespace, self.name, self.version)
@@ -687,6 +757,7 @@ class CodeRepoRelease(BaseModel):
     `updated_by`: Reference to the user that updated this record
     """
     ADMIN_LIST_FIELDS = ('name', 'version')
+    ORDERING_FIELDS = ('id', 'last_updated', 'name')
 
     object = models.OneToOneField(Object, on_delete=models.CASCADE, related_name='code_repo_release')
     name = NameField(null=False, blank=False)
@@ -699,6 +770,10 @@ class CodeRepoRelease(BaseModel):
                 fields=('name', 'version'),
                 name='unique_code_repo_release'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+            models.Index(fields=('name', 'id')),
+        ]
 
     def __str__(self):
         return '%s version %s' % (self.name, self.version)
@@ -734,6 +809,9 @@ class KeyValue(BaseModel):
                 fields=('object', 'key'),
                 name='unique_key_value'),
         ]
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
 
     def __str__(self):
         return self.key
@@ -763,6 +841,136 @@ class TextFile(BaseModel):
     """
     text = models.TextField(max_length=TEXT_FIELD_LENGTH, null=False, blank=False)
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=('last_updated', 'id')),
+        ]
+
+
+class ProvReport(models.Model):
+    """
+    A PROV report for a CodeRun rendered in one of the slower formats, stored so that it only needs to be rendered
+    again when the provenance of the CodeRun changes, which is detected by a change in the fingerprint (the SHA1 hash)
+    of the report's PROV-JSON.
+
+    This is not part of the registry itself, so is not a BaseModel and is not available through the generated API
+    views.
+    """
+    code_run = models.ForeignKey(CodeRun, on_delete=models.CASCADE, related_name='prov_reports')
+    format = models.CharField(max_length=8)
+    # What the report contains in addition to the CodeRun, e.g. its lineage, empty for a report of just the CodeRun
+    variant = models.CharField(max_length=32, blank=True)
+    fingerprint = models.CharField(max_length=40)
+    content = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('code_run', 'format', 'variant'),
+                name='unique_prov_report'),
+        ]
+
+
+class LineageLink(models.Model):
+    """
+    A row of the transitive closure of the lineage of Objects and CodeRuns, recording that the descendant depends on
+    the ancestor. A CodeRun depends on the Objects of its inputs, and an Object depends on the CodeRuns which output
+    its components, and so on. The table is kept up to date by the signal handlers in `lineage.py` and can be rebuilt
+    using the `rebuild_lineage` management command.
+
+    This is not part of the registry itself, so is not a BaseModel and is not available through the generated API
+    views.
+    """
+    OBJECT = 'object'
+    CODE_RUN = 'code_run'
+    NODE_TYPES = (
+        (OBJECT, 'Object'),
+        (CODE_RUN, 'CodeRun'),
+    )
+
+    ancestor_type = models.CharField(max_length=8, choices=NODE_TYPES)
+    ancestor_id = models.PositiveIntegerField()
+    descendant_type = models.CharField(max_length=8, choices=NODE_TYPES)
+    descendant_id = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('ancestor_type', 'ancestor_id', 'descendant_type', 'descendant_id'),
+                name='unique_lineage_link'),
+        ]
+        indexes = [
+            models.Index(fields=('descendant_type', 'descendant_id', 'ancestor_type', 'ancestor_id')),
+        ]
+
+
+class ImportJob(models.Model):
+    """
+    A file of registry records uploaded to be imported in the background by the `process_imports` management command.
+    The file itself is kept in the media storage until the import is complete.
+
+    This is not part of the registry itself, so is not a BaseModel and is not available through the generated API
+    views.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    )
+
+    JSONL = 'jsonl'
+    CSV = 'csv'
+    FORMAT_CHOICES = (
+        (JSONL, 'JSON lines'),
+        (CSV, 'CSV'),
+    )
+
+    created_by = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='import_jobs')
+    created = models.DateTimeField(auto_now_add=True)
+    file_name = models.CharField(max_length=CHAR_FIELD_LENGTH, blank=True)
+    file_format = models.CharField(max_length=8, choices=FORMAT_CHOICES)
+    record_type = models.CharField(max_length=CHAR_FIELD_LENGTH, blank=True)
+    file = models.FileField(upload_to='imports/')
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    started = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('status', 'id')),
+        ]
+
+    def rows_per_second(self):
+        """
+        The rate at which rows have been processed, or None if processing has not started.
+        """
+        if self.started is None:
+            return None
+        seconds = ((self.finished or timezone.now()) - self.started).total_seconds()
+        return self.rows_processed / seconds if seconds > 0 else None
+
+
+class ImportJobError(models.Model):
+    """
+    An error importing a row of the file of an ImportJob.
+    """
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name='errors')
+    row = models.PositiveIntegerField()
+    # JSON encoded errors, in the same form as the errors returned by the API when creating the object fails
+    detail = models.TextField()
+
+    class Meta:
+        ordering = ('row', 'id')
+
 
 def _is_base_model_subclass(name, cls):
     """
@@ -1,11 +1,101 @@
 import prov.model
 import prov.serializers
 import prov.dot
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from hashlib import sha1
 import io
 import json
+import subprocess
+import threading
+
+from django.core.cache import cache
+from django.db import IntegrityError, connections
 
 from . import models
 
+# Formats of PROV report which are stored once rendered, as they are slow to render
+STORED_FORMATS = ('jpg', 'svg', 'xml', 'provn')
+
+# Formats of PROV report which are images rendered by graphviz in the IMAGE_RENDER_WORKERS threads
+IMAGE_FORMATS = ('jpg', 'svg')
+
+# Number of graphviz processes rendering images at once in each server process
+IMAGE_RENDER_WORKERS = 2
+
+# Number of images which can be waiting to be rendered in each server process, further requests are refused
+IMAGE_RENDER_QUEUE = 8
+
+# Seconds that a request waits for an image to be rendered before returning 202 and leaving it to render
+IMAGE_RENDER_WAIT = 5
+
+# Seconds that graphviz is given to render an image before it is killed
+IMAGE_RENDER_TIMEOUT = 60
+
+# Largest documents and images that are rendered, in PROV records and bytes
+IMAGE_MAX_RECORDS = 2000
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+
+# Namespace of the identifiers in PROV reports
+DEFAULT_NAMESPACE = 'http://data.scrc.uk'
+
+# Types of PROV record used in PROV reports, as named in PROV-JSON and PROV-N
+ACTIVITY = 'activity'
+ENTITY = 'entity'
+ASSOCIATION = 'wasAssociatedWith'
+PROV_RECORD_TYPES = {
+    ACTIVITY: prov.model.PROV_ACTIVITY,
+    ENTITY: prov.model.PROV_ENTITY,
+    ASSOCIATION: prov.model.PROV_ASSOCIATION,
+}
+
+# Formal attributes of each type of record, in the order they are written in PROV-N
+PROV_FORMAL_ATTRIBUTES = {
+    ACTIVITY: ('prov:startTime', 'prov:endTime'),
+    ENTITY: (),
+    ASSOCIATION: ('prov:activity', 'prov:agent', 'prov:plan'),
+}
+PROV_TIME_ATTRIBUTES = ('prov:startTime', 'prov:endTime')
+
+# Relations of an Object used in its metadata, which are loaded along with the components in a report
+OBJECT_META_RELATIONS = ('storage_location__storage_root', 'data_product__namespace', 'code_repo_release',
+                         'external_object')
+
+_render_pool = ThreadPoolExecutor(max_workers=IMAGE_RENDER_WORKERS, thread_name_prefix='prov-render')
+_render_slots = threading.BoundedSemaphore(IMAGE_RENDER_WORKERS + IMAGE_RENDER_QUEUE)
+
+
+class RenderError(Exception):
+    """
+    Error raised when a PROV report cannot be rendered as an image.
+    """
+
+
+class RenderBusy(Exception):
+    """
+    Error raised when a PROV report image cannot be queued for rendering because the render queue is full.
+    """
+
+
+class RenderPending(Exception):
+    """
+    Error raised when a PROV report image is still being rendered, and should be requested again later.
+    """
+
+
+def _run_components(relation, code_run_ids):
+    """
+    Return a dict of the ObjectComponents in the given relation (`inputs` or `outputs`) of each of the CodeRuns, loaded
+    along with their Objects and everything used in the metadata of the Objects with a single query.
+    """
+    through = getattr(models.CodeRun, relation).through
+    links = through.objects.filter(coderun_id__in=code_run_ids).order_by('id').select_related(
+        'objectcomponent__object', *('objectcomponent__object__' + name for name in OBJECT_META_RELATIONS))
+    components = defaultdict(list)
+    for link in links:
+        components[link.coderun_id].append(link.objectcomponent)
+    return components
+
 
 def _generate_object_meta(obj):
     data = []
@@ -37,73 +127,178 @@ def _generate_object_meta(obj):
     return data
 
 
-def generate_prov_document(code_run):
+def find_lineage(code_run, upstream=True, downstream=True, depth=1):
     """
-    Generate a PROV document for a CodeRun detailing all the input and outputs and how they were generated.
+    Find the CodeRuns in the lineage of a CodeRun, following the links between runs through the ObjectComponents that
+    one run outputs and another uses as an input.
+
+    Each level of the lineage is found with a single query, so this takes at most one query per level in each
+    direction.
+
+    :param code_run: The CodeRun to find the lineage of
+    :param upstream: Whether to include the runs which produced the inputs of the run, and so on
+    :param downstream: Whether to include the runs which used the outputs of the run, and so on
+    :param depth: The maximum number of runs away from the run to follow the links
+    :return: A list of the CodeRuns found, not including the run itself, in order of distance from the run
+    """
+    found = {code_run.id}
+    code_runs = []
+    for lookup, enabled in (('outputs__inputs_of__in', upstream), ('inputs__outputs_of__in', downstream)):
+        frontier = {code_run.id}
+        for _ in range(depth if enabled else 0):
+            level = list(models.CodeRun.objects.filter(**{lookup: frontier}).exclude(id__in=found)
+                         .distinct().order_by('id'))
+            if not level:
+                break
+            code_runs.extend(level)
+            frontier = {run.id for run in level}
+            found.update(frontier)
+    return code_runs
+
+
+def generate_prov_records(code_run, related_runs=()):
+    """
+    Generate the records of the PROV document for a CodeRun detailing all the input and outputs and how they were
+    generated, from which the report can be written directly in PROV-JSON or PROV-N without building a ProvDocument.
+
+    :param code_run: The CodeRun to generate the PROV records for
+    :param related_runs: Other CodeRuns to include in the same document, e.g. the lineage of the run
+    :return: A list of (record type, identifier, attributes) tuples, where the record type is a PROV-JSON record type,
+        the identifier is None for relations and the attributes are a list of (name, value) tuples
+    """
+    code_runs = [code_run] + list(related_runs)
+    code_run_ids = [run.id for run in code_runs]
+    run_inputs = _run_components('inputs', code_run_ids)
+    run_outputs = _run_components('outputs', code_run_ids)
+
+    records = []
+    entities = set()
+
+    def add_entity(identifier, attributes):
+        if identifier not in entities:
+            entities.add(identifier)
+            records.append((ENTITY, identifier, [('prov:type', 'file')] + attributes))
+        return identifier
+
+    for run in code_runs:
+        cr = '/api/code_run/' + str(run.id)
+        records.append((ACTIVITY, cr, [
+            ('prov:startTime', run.run_date),
+            ('prov:type', 'run'),
+            ('description', run.description),
+        ]))
+        for component in run_inputs[run.id] + run_outputs[run.id]:
+            c = add_entity('/api/object_component/' + str(component.id), [('name', component.name)])
+            records.append((ASSOCIATION, None, [('prov:activity', cr), ('prov:agent', c)]))
+            o = add_entity('/api/object/' + str(component.object.id), _generate_object_meta(component.object))
+            records.append((ASSOCIATION, None, [('prov:activity', c), ('prov:agent', o)]))
+
+    return records
+
+
+def _record_attributes(attributes):
+    """
+    Return the names of the given attributes with a list of the distinct values of each, in the order the names and
+    values first appear. Attributes without a value are left out.
+    """
+    values = {}
+    for name, value in attributes:
+        if value is not None and value not in values.setdefault(name, []):
+            values[name].append(value)
+    return [(name, name_values) for (name, name_values) in values.items() if name_values]
+
+
+def _provn_value(value):
+    value = value.replace('"', '\\"')
+    return '"""%s"""' % value if '\n' in value else '"%s"' % value
+
+
+def prov_json(records):
+    """
+    Return the PROV-JSON for PROV records from generate_prov_records(), as the data returned by
+    serialize_prov_document() for the ProvDocument of the records.
+
+    Relations are given anonymous identifiers numbered in the order they first appear, with the same identifier for
+    identical relations, and record attributes with several values have the values in the order they were given.
+    """
+    container = {'prefix': {'default': DEFAULT_NAMESPACE}}
+    anonymous_ids = {}
+    for record_type, identifier, attributes in records:
+        record_attributes = _record_attributes(attributes)
+        if identifier is None:
+            key = (record_type, tuple((name, tuple(values)) for (name, values) in record_attributes))
+            identifier = anonymous_ids.setdefault(key, '_:id%d' % (len(anonymous_ids) + 1))
+        record_json = {}
+        for name, values in record_attributes:
+            if name in PROV_TIME_ATTRIBUTES:
+                record_json[name] = values[0].isoformat()
+            elif name in PROV_FORMAL_ATTRIBUTES[record_type]:
+                record_json[name] = values[0]
+            else:
+                record_json[name] = values[0] if len(values) == 1 else values
+        type_records = container.setdefault(record_type, {})
+        if identifier not in type_records:
+            type_records[identifier] = record_json
+        elif isinstance(type_records[identifier], list):
+            type_records[identifier].append(record_json)
+        else:
+            type_records[identifier] = [type_records[identifier], record_json]
+    return container
+
+
+def prov_n(records):
+    """
+    Return the PROV-N for PROV records from generate_prov_records(), as returned by serialize_prov_document() for the
+    ProvDocument of the records.
+    """
+    lines = ['document', 'default <%s>' % DEFAULT_NAMESPACE, '']
+    for record_type, identifier, attributes in records:
+        record_attributes = dict(_record_attributes(attributes))
+        items = [identifier] if identifier is not None else []
+        for name in PROV_FORMAL_ATTRIBUTES[record_type]:
+            if name not in record_attributes:
+                items.append('-')
+            elif name in PROV_TIME_ATTRIBUTES:
+                items.append(record_attributes[name][0].isoformat())
+            else:
+                items.append(record_attributes[name][0])
+        extra = ['%s=%s' % (name, _provn_value(value)) for (name, values) in record_attributes.items()
+                 if name not in PROV_FORMAL_ATTRIBUTES[record_type] for value in values]
+        if extra:
+            items.append('[%s]' % ', '.join(extra))
+        lines.append('%s(%s)' % (record_type, ', '.join(items)))
+    return '\n  '.join(lines) + '\nendDocument'
+
+
+def prov_document(records):
+    """
+    Build a ProvDocument from PROV records from generate_prov_records().
 
     This uses the W3C PROV ontology (https://www.w3.org/TR/prov-o/).
 
-    :param code_run: The CodeRun to generate the PROV document for
+    :param records: The PROV records, as returned by generate_prov_records()
     :return: A PROV-O document
     """
     doc = prov.model.ProvDocument()
-    doc.set_default_namespace('http://data.scrc.uk')
-    cr = doc.activity(
-        '/api/code_run/' + str(code_run.id),
-        str(code_run.run_date),
-        None,
-        {
-            prov.model.PROV_TYPE: 'run',
-            'description': code_run.description,
-        }
-    )
-    prov_objects = {}
-    prov_object_components = {}
-    for input in code_run.inputs.all():
-        if input.id in prov_object_components:
-            i = prov_object_components[input.id]
-        else:
-            i = doc.entity('/api/object_component/' + str(input.id), (
-                (prov.model.PROV_TYPE, 'file'),
-                ('name', input.name)
-            ))
-            prov_object_components[input.id] = i
-        doc.association(cr, i)
-
-        if input.object.id in prov_objects:
-            obj = prov_objects[input.object.id]
-        else:
-            obj = doc.entity('/api/object/' + str(input.object.id), (
-                (prov.model.PROV_TYPE, 'file'),
-                *_generate_object_meta(input.object)
-            ))
-            prov_objects[input.object.id] = obj
-        doc.association(i, obj)
-
-    for output in code_run.outputs.all():
-        if output.id in prov_object_components:
-            o = prov_object_components[output.id]
-        else:
-            o = doc.entity('/api/object_component/' + str(output.id), (
-                (prov.model.PROV_TYPE, 'file'),
-                ('name', output.name)
-            ))
-            prov_object_components[output.id] = o
-        doc.association(cr, o)
-
-        if output.object.id in prov_objects:
-            obj = prov_objects[output.object.id]
-        else:
-            obj = doc.entity('/api/object/' + str(output.object.id), (
-                (prov.model.PROV_TYPE, 'file'),
-                *_generate_object_meta(output.object)
-            ))
-            prov_objects[output.object.id] = obj
-        doc.association(o, obj)
-
+    doc.set_default_namespace(DEFAULT_NAMESPACE)
+    for record_type, identifier, attributes in records:
+        doc.new_record(PROV_RECORD_TYPES[record_type], identifier, attributes)
     return doc
 
 
+def generate_prov_document(code_run, related_runs=()):
+    """
+    Generate a PROV document for a CodeRun detailing all the input and outputs and how they were generated.
+
+    This uses the W3C PROV ontology (https://www.w3.org/TR/prov-o/).
+
+    :param code_run: The CodeRun to generate the PROV document for
+    :param related_runs: Other CodeRuns to include in the same document, e.g. the lineage of the run
+    :return: A PROV-O document
+    """
+    return prov_document(generate_prov_records(code_run, related_runs))
+
+
 def serialize_prov_document(doc, format):
     """
     Serialise a PROV document as either a JPEG or SVG image or an XML or PROV-N report.
@@ -112,15 +307,8 @@ def serialize_prov_document(doc, format):
     :param format: The format to generate: jpg, svg, xml or provn
     :return: The PROV report in the specified format
     """
-    if format in ('jpg', 'svg'):
-        dot = prov.dot.prov_to_dot(doc)
-        with io.BytesIO() as buf:
-            if format == 'jpg':
-                buf.write(dot.create_jpg())
-            else:
-                buf.write(dot.create_svg())
-            buf.seek(0)
-            return buf.read()
+    if format in IMAGE_FORMATS:
+        return _run_dot(prov.dot.prov_to_dot(doc).to_string().encode('utf-8'), format)
     elif format == 'xml':
         with io.StringIO() as buf:
             serializer = prov.serializers.get('xml')
@@ -140,3 +328,129 @@ def serialize_prov_document(doc, format):
             buf.seek(0)
             return json.loads(buf.read())
 
+
+def _run_dot(source, format):
+    """
+    Render a graphviz dot graph in the given format in a `dot` process, which is killed if it takes longer than
+    IMAGE_RENDER_TIMEOUT seconds.
+    """
+    try:
+        result = subprocess.run(['dot', '-T%s' % format], input=source, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, timeout=IMAGE_RENDER_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise RenderError('Rendering took longer than %d seconds' % IMAGE_RENDER_TIMEOUT)
+    except OSError as ex:
+        raise RenderError('Could not run dot: %s' % ex)
+    if result.returncode != 0:
+        raise RenderError('dot failed: %s' % result.stderr.decode('utf-8', 'replace').strip())
+    return result.stdout
+
+
+def _render_key(code_run, format, variant, fingerprint):
+    return 'prov-render:%d:%s:%s:%s' % (code_run.id, format, variant, fingerprint)
+
+
+def _render_image(code_run, format, variant, fingerprint, source):
+    """
+    Render a PROV report image from its dot source and store it, run in the render pool. Any error is stored in the
+    cache so that the request which next asks for the report can report it.
+    """
+    key = _render_key(code_run, format, variant, fingerprint)
+    try:
+        content = _run_dot(source, format)
+        if len(content) > IMAGE_MAX_BYTES:
+            raise RenderError('The rendered image is larger than %d bytes' % IMAGE_MAX_BYTES)
+        try:
+            models.ProvReport.objects.update_or_create(code_run=code_run, format=format, variant=variant,
+                                                       defaults={'fingerprint': fingerprint, 'content': content})
+        except IntegrityError:
+            # Another request stored the report at the same time
+            pass
+        return content
+    except RenderError as ex:
+        cache.set(key + ':error', str(ex), IMAGE_RENDER_TIMEOUT)
+        raise
+    finally:
+        cache.delete(key)
+        connections.close_all()
+        _render_slots.release()
+
+
+def _queue_image(code_run, doc, format, variant, fingerprint):
+    """
+    Queue a PROV report image to be rendered and wait up to IMAGE_RENDER_WAIT seconds for it.
+
+    Renders are shared through the cache, so an image that is already being rendered by any server process is not
+    queued again and RenderPending is raised straight away. RenderBusy is raised if the render queue of this process
+    is full.
+    """
+    key = _render_key(code_run, format, variant, fingerprint)
+    error = cache.get(key + ':error')
+    if error is not None:
+        cache.delete(key + ':error')
+        raise RenderError(error)
+    if len(doc.get_records()) > IMAGE_MAX_RECORDS:
+        raise RenderError('The report has more than %d records to render as an image' % IMAGE_MAX_RECORDS)
+    if not cache.add(key, True, IMAGE_RENDER_TIMEOUT + IMAGE_RENDER_WAIT):
+        raise RenderPending()
+    if not _render_slots.acquire(blocking=False):
+        cache.delete(key)
+        raise RenderBusy()
+    try:
+        source = prov.dot.prov_to_dot(doc).to_string().encode('utf-8')
+        future = _render_pool.submit(_render_image, code_run, format, variant, fingerprint, source)
+    except Exception:
+        cache.delete(key)
+        _render_slots.release()
+        raise
+    try:
+        return future.result(timeout=IMAGE_RENDER_WAIT)
+    except TimeoutError:
+        raise RenderPending()
+    except RenderError:
+        # The error is reported here, so is not left for the next request
+        cache.delete(key + ':error')
+        raise
+
+
+def render_prov_report(code_run, records, format, variant=''):
+    """
+    Return the PROV report for a CodeRun in the given format, as returned by serialize_prov_document().
+
+    JSON and PROV-N reports are written directly from the PROV records, and a ProvDocument is only built for the XML
+    and image formats.
+
+    Reports in the STORED_FORMATS are stored in the database when they are rendered, along with a fingerprint of the
+    report's PROV-JSON, and the stored report is returned as long as the PROV document has the same fingerprint.
+
+    Images are rendered by graphviz in a bounded pool of threads rather than by the request. If the image is not
+    ready within IMAGE_RENDER_WAIT seconds RenderPending is raised and it carries on rendering, to be returned when
+    it is next requested. RenderBusy is raised if too many images are waiting to be rendered, and RenderError if the
+    image cannot be rendered.
+
+    :param code_run: The CodeRun the report is for
+    :param records: The PROV records for the CodeRun, as generated by generate_prov_records()
+    :param format: The format to return: jpg, svg, xml, provn or json
+    :param variant: Identifies what the report contains if it is not just the CodeRun, e.g. its lineage
+    :return: The PROV report in the specified format
+    """
+    data = prov_json(records)
+    if format not in STORED_FORMATS:
+        return data
+    fingerprint = sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+    report = models.ProvReport.objects.filter(code_run=code_run, format=format, variant=variant,
+                                              fingerprint=fingerprint).first()
+    if report is not None:
+        content = bytes(report.content)
+        return content if format in IMAGE_FORMATS else content.decode('utf-8')
+    if format in IMAGE_FORMATS:
+        return _queue_image(code_run, prov_document(records), format, variant, fingerprint)
+    value = prov_n(records) if format == 'provn' else serialize_prov_document(prov_document(records), format)
+    content = value.encode('utf-8')
+    try:
+        models.ProvReport.objects.update_or_create(code_run=code_run, format=format, variant=variant,
+                                                   defaults={'fingerprint': fingerprint, 'content': content})
+    except IntegrityError:
+        # Another request stored the report at the same time
+        pass
+    return value
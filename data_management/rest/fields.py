@@ -0,0 +1,170 @@
+from urllib import parse
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.urls import get_script_prefix, resolve, Resolver404
+from django.utils.encoding import uri_to_iri
+from rest_framework import relations
+from rest_framework.exceptions import ValidationError
+
+# Stands in for the primary key when reversing a URL to make a template for the URLs of a view
+PK_PLACEHOLDER = '__pk__'
+
+
+def resolve_url(url):
+    """
+    Resolve an API URL, either absolute or relative to the server, to the view it refers to, allowing for the site being
+    served under a script prefix. Raises Resolver404 if the URL does not match a view.
+    """
+    if url.startswith(('http:', 'https:')):
+        # If needed convert absolute URLs to relative path
+        url = parse.urlparse(url).path
+        prefix = get_script_prefix()
+        if url.startswith(prefix):
+            url = '/' + url[len(prefix):]
+    return resolve(uri_to_iri(parse.unquote(url)))
+
+
+class URLTemplateMixin:
+    """
+    Mixin for hyperlinked fields which reverses the URL of each view only once per field, and then builds the URL of
+    each object by substituting its primary key into the result. Reversing a URL and building the absolute URI is
+    much slower than a string substitution, which matters when serializing many links.
+    """
+    def __init__(self, *args, **kwargs):
+        self.url_templates = {}
+        super().__init__(*args, **kwargs)
+
+    def get_url(self, obj, view_name, request, format):
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        if self.lookup_field != 'pk':
+            return super().get_url(obj, view_name, request, format)
+        key = (view_name, format)
+        if key not in self.url_templates:
+            kwargs = {self.lookup_url_kwarg: PK_PLACEHOLDER}
+            self.url_templates[key] = self.reverse(view_name, kwargs=kwargs, request=request, format=format)
+        return self.url_templates[key].replace(PK_PLACEHOLDER, str(obj.pk))
+
+
+class ManyRelatedField(relations.ManyRelatedField):
+    """
+    ManyRelatedField resolving all the given URLs together, fetching the related objects with a single query and
+    reporting all the URLs that cannot be resolved rather than just the first.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        lookup_values = []
+        parse_errors = {}
+        for index, item in enumerate(data):
+            try:
+                lookup_values.append(child.get_lookup_value(item))
+            except ValidationError as ex:
+                lookup_values.append(None)
+                parse_errors[index] = ex.detail
+        objects = child.get_objects(set(value for value in lookup_values if value is not None))
+
+        errors = []
+        for index, (item, lookup_value) in enumerate(zip(data, lookup_values)):
+            if index in parse_errors:
+                errors.extend('%s (%s)' % (message, item) for message in parse_errors[index])
+            elif lookup_value not in objects:
+                errors.append('%s (%s)' % (child.error_messages['does_not_exist'], item))
+        if errors:
+            raise ValidationError(errors)
+        return [objects[lookup_value] for lookup_value in lookup_values]
+
+
+class HyperlinkedRelatedField(URLTemplateMixin, relations.HyperlinkedRelatedField):
+    """
+    HyperlinkedRelatedField building the URLs from a template, and resolving lists of URLs together when used with
+    many=True.
+
+    When a list of objects is deserialized the URLs given for the field in all of them can be resolved up front by
+    `prefetch`, so that each object does not need its own query.
+    """
+    def __init__(self, *args, **kwargs):
+        self.prefetched = None
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in relations.MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return ManyRelatedField(**list_kwargs)
+
+    def get_lookup_value(self, data):
+        """
+        Return the value of the lookup field (the primary key) given by a URL, raising a ValidationError if the URL
+        is not a valid URL for this field's view. This does not check that the object exists.
+        """
+        request = self.context.get('request', None)
+        if not isinstance(data, str):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        try:
+            match = resolve_url(data)
+        except Resolver404:
+            self.fail('no_match')
+
+        try:
+            expected_viewname = request.versioning_scheme.get_versioned_viewname(self.view_name, request)
+        except AttributeError:
+            expected_viewname = self.view_name
+
+        if match.view_name != expected_viewname:
+            self.fail('incorrect_match')
+
+        lookup_value = match.kwargs[self.lookup_url_kwarg]
+        opts = self.get_queryset().model._meta
+        field = opts.pk if self.lookup_field == 'pk' else opts.get_field(self.lookup_field)
+        try:
+            return field.to_python(lookup_value)
+        except DjangoValidationError:
+            self.fail('does_not_exist')
+
+    def prefetch(self, urls):
+        """
+        Fetch the objects given by all the URLs with a single query, to be used until `clear_prefetched` is called.
+        Invalid URLs are skipped here, and reported when they are deserialized.
+        """
+        lookup_values = set()
+        for url in urls:
+            try:
+                lookup_values.add(self.get_lookup_value(url))
+            except ValidationError:
+                pass
+        self.prefetched = self.get_objects(lookup_values)
+
+    def clear_prefetched(self):
+        self.prefetched = None
+
+    def get_objects(self, lookup_values):
+        """
+        Return a dict mapping each of the given lookup values to the object it refers to, leaving out any that do not
+        exist.
+        """
+        if self.prefetched is not None:
+            return {value: self.prefetched[value] for value in lookup_values if value in self.prefetched}
+        if not lookup_values:
+            return {}
+        return self.get_queryset().in_bulk(lookup_values, field_name=self.lookup_field)
+
+    def to_internal_value(self, data):
+        lookup_value = self.get_lookup_value(data)
+        objects = self.get_objects({lookup_value})
+        if lookup_value not in objects:
+            self.fail('does_not_exist')
+        return objects[lookup_value]
+
+
+class HyperlinkedIdentityField(URLTemplateMixin, relations.HyperlinkedIdentityField):
+    """
+    HyperlinkedIdentityField building the URLs from a template.
+    """
@@ -1,18 +1,181 @@
 from collections import OrderedDict
+from hashlib import sha1
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
 from rest_framework import pagination, response
+from rest_framework.exceptions import NotFound
+
+from data_management.generations import get_generations, related_models
+
+
+def estimate_count(queryset):
+    """
+    Return the number of rows in the table of the queryset's model according to the database statistics, or None if
+    the database does not provide an estimate.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
 
 
 class CustomPagination(pagination.CursorPagination):
+    """
+    Cursor pagination which also returns the total number of results.
+
+    Results are ordered by id unless the view's filters choose another ordering, which must end in a unique field.
+
+    Exact counts are cached against the generations of the tables they depend on so walking through the pages of a
+    query only counts the results once. Unfiltered queries on large tables use the database's estimate of the table
+    size instead, and counting can be switched off entirely by passing `count=false`. The `count_exact` field of the
+    response says whether the returned count is exact.
+    """
     ordering = '-id'
+    count_query_param = 'count'
+    # Counts are invalidated by the table generations changing so can be cached for a long time
+    count_cache_timeout = 60 * 60 * 24
+    # Unfiltered tables estimated to have more rows than this return the estimate rather than an exact count
+    estimate_count_threshold = 100000
+    # Query arguments which do not affect which rows are returned
+    NON_FILTER_PARAMS = ('cursor', 'format', 'fields', 'omit', 'expand', 'relations', 'count', 'ordering')
 
     def paginate_queryset(self, queryset, request, view=None):
-        self.count = queryset.count()
-        return super().paginate_queryset(queryset, request, view)
+        """
+        Paginate the queryset using a keyset over all of the ordering fields.
+
+        This follows CursorPagination.paginate_queryset except that the cursor position holds the value of every
+        ordering field, the last of which is always the unique id, rather than only the first. Each page is then a
+        range scan on the matching composite index, however many rows share a value of the first field.
+        """
+        self.count, self.count_exact = self.get_count(queryset, request)
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*pagination._reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self._get_keyset_filter(current_position, reverse))
+
+        try:
+            results = list(queryset[offset:offset + self.page_size + 1])
+        except (ValueError, ValidationError):
+            # A position value which can't be converted to the type of its field
+            raise NotFound(self.invalid_cursor_message)
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _get_keyset_filter(self, position, reverse):
+        """
+        Return the filter selecting the rows after the given position in the ordering (or before it for a reverse
+        cursor).
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip('-')
+            lookup = '__lt' if order.startswith('-') != reverse else '__gt'
+            condition |= Q(**equal, **{field + lookup: value})
+            equal[field] = value
+
+        # Also bound the first field on its own so that the database can use it for the start of the index range
+        first = self.ordering[0]
+        bound = '__lte' if first.startswith('-') != reverse else '__gte'
+        return Q(**{first.lstrip('-') + bound: values[0]}) & condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            if isinstance(instance, dict):
+                values.append(str(instance[field_name]))
+            else:
+                values.append(str(getattr(instance, field_name)))
+        return json.dumps(values)
+
+    def get_count(self, queryset, request):
+        """
+        Return the number of results of the query and whether this is an exact count.
+        """
+        if request.query_params.get(self.count_query_param, '').lower() in ('false', '0'):
+            return None, False
+        filters = sorted(
+            (key, tuple(values)) for key, values in request.query_params.lists()
+            if key not in self.NON_FILTER_PARAMS
+        )
+        if not filters:
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate > self.estimate_count_threshold:
+                return estimate, False
+        generations = get_generations(related_models(queryset.model))
+        query_hash = sha1(repr((generations, request.path, filters)).encode('utf-8')).hexdigest()
+        key = 'count:%s:%s' % (queryset.model._meta.label_lower, query_hash)
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count, True
 
     def get_paginated_response(self, data):
         return response.Response(OrderedDict([
             ('count', self.count),
+            ('count_exact', self.count_exact),
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('results', data),
-        ]))
\ No newline at end of file
+        ]))
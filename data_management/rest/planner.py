@@ -0,0 +1,112 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+class QueryPlan:
+    """
+    The columns and related objects that need to be loaded to serialize a model with a given serializer.
+
+    Applying the plan to a queryset means that serializing any number of objects from it takes a fixed number of
+    queries: forward relations only need their key column, reverse one-to-one relations are joined and many relations
+    are prefetched, loading only the columns needed to build their links.
+    """
+    def __init__(self, model, field_names, columns, select_related, prefetch_related):
+        self.model = model
+        self.field_names = tuple(field_names)
+        self.columns = tuple(columns)
+        self.select_related = tuple(select_related)
+        self.prefetch_related = tuple(prefetch_related)
+
+    def apply(self, queryset, extra_columns=()):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset.only(*self.columns, *extra_columns)
+
+
+def _related_queryset(model_field):
+    """
+    Return the queryset used to prefetch a many relation, loading only the primary key of the related objects (and
+    the foreign key back to the parent object for reverse foreign keys, which the prefetch needs to match them up).
+    """
+    related_model = model_field.related_model
+    columns = [related_model._meta.pk.name]
+    if model_field.one_to_many:
+        columns.append(model_field.field.name)
+    return related_model._default_manager.only(*columns)
+
+
+def _expanded_queryset(model_field, serializer):
+    """
+    Return the queryset used to prefetch a relation which is serialized as nested objects by the given serializer,
+    itself planned so that the nested objects are loaded in a fixed number of queries.
+    """
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    columns = []
+    if model_field.one_to_many or (model_field.one_to_one and not model_field.concrete):
+        columns.append(model_field.field.name)
+    queryset = model_field.related_model._default_manager.all()
+    return get_plan(type(serializer), expand=serializer.expand).apply(queryset, columns)
+
+
+def build_plan(serializer_class, fields=None, expand=frozenset()):
+    """
+    Inspect the fields of the given model serializer to work out how to query its model.
+
+    If `fields` is given only those serializer fields are taken into account. Relations listed in `expand` are
+    prefetched using their own plans.
+    """
+    model = serializer_class.Meta.model
+    opts = model._meta
+    serializer_fields = serializer_class(fields=fields, expand=expand).fields
+    columns = [opts.pk.name]
+    select_related = []
+    prefetch_related = []
+    for field in serializer_fields.values():
+        if field.source == '*':
+            continue
+        try:
+            model_field = opts.get_field(field.source_attrs[0])
+        except FieldDoesNotExist:
+            # Non-database fields, e.g. methods listed in EXTRA_DISPLAY_FIELDS
+            continue
+        if isinstance(field, BaseSerializer):
+            prefetch_related.append(Prefetch(model_field.name, queryset=_expanded_queryset(model_field, field)))
+            if model_field.concrete and not model_field.many_to_many:
+                columns.append(model_field.name)
+        elif model_field.many_to_many or model_field.one_to_many:
+            prefetch_related.append(Prefetch(model_field.name, queryset=_related_queryset(model_field)))
+        elif model_field.concrete:
+            columns.append(model_field.name)
+        else:
+            # Reverse one-to-one relation, joined so we can link to it without a query per object
+            select_related.append(model_field.name)
+            columns.append(model_field.name + '__' + model_field.related_model._meta.pk.name)
+    return QueryPlan(model, serializer_fields.keys(), columns, select_related, prefetch_related)
+
+
+# Maximum number of QueryPlans cached in each process, which is bounded as the fields and expanded relations of a plan
+# are chosen by the client
+PLAN_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def get_plan(serializer_class, fields=None, expand=frozenset()):
+    """
+    Return the (cached) QueryPlan for the given model serializer, optionally restricted to a set of fields and with
+    a set of relations expanded. The least recently used plans are dropped once PLAN_CACHE_SIZE plans are cached.
+    """
+    return build_plan(serializer_class, fields, expand)
+
+
+def plan_queryset(queryset, serializer_class, fields=None, expand=frozenset(), extra_columns=()):
+    """
+    Apply the QueryPlan for the given model serializer to a queryset, also loading any `extra_columns` needed by the
+    caller.
+    """
+    return get_plan(serializer_class, fields, expand).apply(queryset, extra_columns)
@@ -89,3 +89,14 @@ class BrowsableAPIRenderer(renderers.BrowsableAPIRenderer):
     Subclassing the BrowsableAPIRenderer to use our custom HTMLFormRenderer.
     """
     form_renderer_class = HTMLFormRenderer
+
+
+class NDJSONRenderer(renderers.JSONRenderer):
+    """
+    Renderer for newline delimited JSON, rendering each item as compact JSON followed by a newline.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(data, accepted_media_type, renderer_context) + b'\n'
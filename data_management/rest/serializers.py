@@ -1,9 +1,17 @@
+from collections import Counter
+import json
+
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
+from django.db import connection, transaction
 from rest_framework import serializers
 from rest_framework.reverse import reverse
+from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
 
-from data_management import models
+from data_management import models, validators
+from data_management.generations import bump_generation
+from data_management.lineage import links_created
+from data_management.rest.fields import HyperlinkedIdentityField, HyperlinkedRelatedField, ManyRelatedField
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -24,20 +32,146 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['url', 'name']
 
 
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer creating all the objects in a single transaction using bulk inserts.
+
+    Where the database can return the ids of rows created by a bulk insert (e.g. PostgreSQL) the objects and then
+    their many-to-many relations are inserted using bulk_create, otherwise each object is saved individually. As
+    bulk_create does not send any signals the generations of the affected models are bumped here.
+
+    The URLs of the related objects are resolved for the whole list before the objects are validated, with a query for
+    each relation rather than for each object.
+    """
+    batch_size = 1000
+
+    def to_internal_value(self, data):
+        related_fields = {}
+        if isinstance(data, list):
+            for field in self.child._writable_fields:
+                if isinstance(field, ManyRelatedField) and isinstance(field.child_relation, HyperlinkedRelatedField):
+                    related_fields[field.child_relation] = [
+                        url for item in data if isinstance(item, dict) and isinstance(item.get(field.field_name), list)
+                        for url in item[field.field_name]
+                    ]
+                elif isinstance(field, HyperlinkedRelatedField):
+                    related_fields[field] = [
+                        item[field.field_name] for item in data if isinstance(item, dict) and field.field_name in item
+                    ]
+        for field, urls in related_fields.items():
+            field.prefetch(urls)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            for field in related_fields:
+                field.clear_prefetched()
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        opts = model._meta
+        instances = []
+        relations = []
+        for attrs in validated_data:
+            many = {name: attrs.pop(name) for name in list(attrs) if opts.get_field(name).many_to_many}
+            instances.append(model(**attrs))
+            relations.append(many)
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                model.objects.bulk_create(instances, batch_size=self.batch_size)
+                self._bulk_create_relations(instances, relations)
+                bump_generation(model)
+            else:
+                for instance, many in zip(instances, relations):
+                    instance.save()
+                    for name, values in many.items():
+                        getattr(instance, name).set(values)
+        return instances
+
+    def _bulk_create_relations(self, instances, relations):
+        """
+        Insert the many-to-many rows for the newly created instances, given as a dict for each instance mapping the
+        relation name to the list of related objects.
+        """
+        opts = self.child.Meta.model._meta
+        rows = {}
+        for instance, many in zip(instances, relations):
+            for name, values in many.items():
+                field = opts.get_field(name)
+                if field.auto_created:
+                    # Reverse side of a ManyToManyField declared on the related model
+                    forward = field.remote_field
+                    through = forward.remote_field.through
+                    source, target = forward.m2m_reverse_field_name(), forward.m2m_field_name()
+                else:
+                    through = field.remote_field.through
+                    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+                rows.setdefault((through, field.related_model), []).extend(
+                    through(**{source: instance, target: value}) for value in values
+                )
+        for (through, related_model), through_rows in rows.items():
+            through.objects.bulk_create(through_rows, batch_size=self.batch_size)
+            links_created(through, through_rows)
+            bump_generation(related_model)
+
+
 class BaseSerializer(serializers.HyperlinkedModelSerializer):
     """
     Base class for serializing the data management objects.
 
     Serializes all the defined fields on the model as well as any non-database field or method specified in the models
-    EXTRA_DISPLAY_FIELDS.
+    EXTRA_DISPLAY_FIELDS. The serialized fields can be restricted by passing a set of field names as `fields`.
+
+    Relations can be serialized as nested objects rather than links by passing a set of dotted paths of relation
+    names as `expand`, e.g. {'object.storage_location.storage_root'}. Passing `relations='id'` serializes the object
+    and its relations as ids rather than URLs.
     """
+    serializer_related_field = HyperlinkedRelatedField
+    serializer_url_field = HyperlinkedIdentityField
+
     class Meta:
         model = models.BaseModel
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
+
+    def __init__(self, *args, **kwargs):
+        self.selected_fields = kwargs.pop('fields', None)
+        self.expand = kwargs.pop('expand', frozenset())
+        self.relations = kwargs.pop('relations', 'url')
+        if self.relations == 'id':
+            self.serializer_related_field = serializers.PrimaryKeyRelatedField
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Uniqueness is left to the database's constraints when the object is saved rather than checked with a query
+        # beforehand, with any violation returned as a 409 by the view
+        for field in fields.values():
+            field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+        for name in {path.split('.')[0] for path in self.expand}:
+            if name not in fields:
+                continue
+            model_field = self.Meta.model._meta.get_field(name)
+            nested_expand = frozenset(path[len(name) + 1:] for path in self.expand if path.startswith(name + '.'))
+            serializer_class = get_serializer_class(model_field.related_model)
+            if model_field.many_to_many or model_field.one_to_many:
+                fields[name] = serializer_class(expand=nested_expand, relations=self.relations, many=True,
+                                                read_only=True)
+            else:
+                fields[name] = serializer_class(expand=nested_expand, relations=self.relations, read_only=True,
+                                                allow_null=True)
+        return fields
+
+    def get_validators(self):
+        return [v for v in super().get_validators() if not isinstance(v, UniqueTogetherValidator)]
 
     def get_field_names(self, declared_fields, info):
         expanded_fields = super().get_field_names(declared_fields, info)
-        return expanded_fields + list(self.Meta.model.EXTRA_DISPLAY_FIELDS)
+        expanded_fields = expanded_fields + list(self.Meta.model.EXTRA_DISPLAY_FIELDS)
+        if self.relations == 'id':
+            expanded_fields = ['id' if name == self.url_field_name else name for name in expanded_fields]
+        if self.selected_fields is not None:
+            expanded_fields = [name for name in expanded_fields if name in self.selected_fields]
+        return expanded_fields
 
 
 class IssueSerializer(BaseSerializer):
@@ -51,3 +185,86 @@ for name, cls in models.all_models.items():
     meta_cls = type('Meta', (BaseSerializer.Meta,), {'model': cls, 'read_only_fields': cls.EXTRA_DISPLAY_FIELDS})
     data = {'Meta': meta_cls}
     globals()[name + "Serializer"] = type(name + "Serializer", (BaseSerializer,), data)
+
+
+def get_serializer_class(model):
+    """
+    Return the serializer class for the given data management model.
+    """
+    return globals()[model.__name__ + 'Serializer']
+
+
+class ComponentInputSerializer(serializers.Serializer):
+    """
+    Class for validating an `ObjectComponent` given as part of a composite request.
+    """
+    name = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()])
+    description = serializers.CharField(max_length=models.TEXT_FIELD_LENGTH, required=False, allow_null=True)
+
+
+class RegisterDataProductSerializer(serializers.Serializer):
+    """
+    Class for validating a request to register a `DataProduct` along with its `Namespace`, `StorageLocation`, `Object`
+    and `ObjectComponents`.
+    """
+    namespace = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()])
+    name = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()])
+    version = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, validators=[validators.VersionValidator()])
+    storage_root = serializers.HyperlinkedRelatedField(view_name='storageroot-detail',
+                                                       queryset=models.StorageRoot.objects.all())
+    path = serializers.CharField(max_length=models.PATH_FIELD_LENGTH)
+    hash = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH)
+    description = serializers.CharField(max_length=models.TEXT_FIELD_LENGTH, required=False, allow_null=True)
+    components = ComponentInputSerializer(many=True, required=False)
+
+    def validate_components(self, value):
+        counts = Counter(component['name'] for component in value)
+        duplicates = sorted(name for name, count in counts.items() if count > 1)
+        if duplicates:
+            raise serializers.ValidationError('Duplicate component names [%s]' % ', '.join(duplicates))
+        return value
+
+
+class ComponentReferenceSerializer(serializers.Serializer):
+    """
+    Class for validating a reference to an `ObjectComponent` given by the API URL of its `Object` and its name.
+    """
+    object = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH)
+    name = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, validators=[validators.NameValidator()])
+
+
+class CodeRunManifestSerializer(serializers.Serializer):
+    """
+    Class for validating a request to register a `CodeRun` along with its submission script and inputs and outputs.
+    """
+    run_date = serializers.DateTimeField()
+    description = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH)
+    code_repo = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, required=False, allow_null=True)
+    model_config = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, required=False, allow_null=True)
+    submission_script = serializers.CharField(max_length=models.CHAR_FIELD_LENGTH, required=False)
+    submission_script_text = serializers.CharField(max_length=models.TEXT_FIELD_LENGTH, required=False)
+    inputs = ComponentReferenceSerializer(many=True, required=False)
+    outputs = ComponentReferenceSerializer(many=True, required=False)
+
+    def validate(self, attrs):
+        if ('submission_script' in attrs) == ('submission_script_text' in attrs):
+            raise serializers.ValidationError('Exactly one of submission_script and submission_script_text must be '
+                                              'given')
+        return attrs
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """
+    Class for serializing the status of an ImportJob, including the errors for any rows that could not be imported.
+    """
+    url = serializers.HyperlinkedIdentityField(view_name='import_job')
+    rows_per_second = serializers.FloatField(read_only=True)
+    errors = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ImportJob
+        fields = ['url', 'status', 'file_name', 'file_format', 'record_type', 'created', 'started', 'finished',
+                  'rows_processed', 'rows_failed', 'rows_per_second', 'message', 'errors']
+
+    def get_errors(self, job):
+        return [{'row': error.row, 'errors': json.loads(error.detail)} for error in job.errors.all()]
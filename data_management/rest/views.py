@@ -3,26 +3,44 @@ from copy import deepcopy
 import fnmatch
 from hashlib import sha1
 import hmac
+import math
 import time
 
 from django import forms, db
 from django_filters import filters
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
-from rest_framework.decorators import renderer_classes
-from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.decorators import action, renderer_classes
+from rest_framework.exceptions import APIException
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
-from rest_framework import viewsets, permissions, views, renderers, mixins, exceptions, status
+from rest_framework import viewsets, permissions, views, renderers, mixins, exceptions, status, pagination
 from rest_framework.response import Response
-from django.db import IntegrityError
+from rest_framework.reverse import reverse
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Max, prefetch_related_objects
+from django.http import Http404, StreamingHttpResponse
+from django.urls import Resolver404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend, filterset
 from django_filters import constants
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404, HttpResponse, redirect
 
 from data_management import models
+from data_management.generations import bump_generation, get_generations, get_last_changed, related_models
+from data_management.imports import RECORD_TYPES, create_job
+from data_management.lineage import get_impact, get_lineage, links_created, OBJECT_COMPONENT
 from data_management.rest import serializers
-from data_management.prov import generate_prov_document, serialize_prov_document
+from data_management.rest.fields import PK_PLACEHOLDER, resolve_url
+from data_management.rest.planner import get_plan, plan_queryset
+from data_management.rest.renderers import NDJSONRenderer
+from data_management.prov import find_lineage, generate_prov_records, render_prov_report, RenderBusy, RenderError, \
+    RenderPending, IMAGE_RENDER_WAIT
+from data_management.upsert import unique_fields, unique_violation, upsert
 
 
 class BadQuery(APIException):
@@ -30,6 +48,34 @@ class BadQuery(APIException):
     default_code = 'bad_query'
 
 
+def get_pk_from_url(url, model):
+    """
+    Return the primary key of an object of the given model from its API URL, raising a BadQuery error if the URL is not
+    the API URL of an object of that model.
+    """
+    try:
+        match = resolve_url(url)
+    except Resolver404:
+        match = None
+    view_model = getattr(getattr(match.func, 'cls', None), 'model', None) if match else None
+    if view_model is not model or not str(match.kwargs.get('pk', '')).isdigit():
+        raise BadQuery(detail='Invalid %s URL %s' % (model._meta.verbose_name, url))
+    return int(match.kwargs['pk'])
+
+
+def get_pk(value, model):
+    """
+    Return the primary key of an object of the given model given either as an id or as its API URL, raising a BadQuery
+    error if the value is neither.
+    """
+    if isinstance(value, str) and not value.isdigit():
+        return get_pk_from_url(value, model)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadQuery(detail='Invalid %s id %s' % (model._meta.verbose_name, value))
+
+
 class JPEGRenderer(renderers.BaseRenderer):
     """
     Custom rendered for returning JPEG images.
@@ -103,15 +149,246 @@ class ProvReportView(views.APIView):
     API view for returning a PROV report for a CodeRun.
 
     This report can be returned as JSON (default) or JPEG, SVG, XML or PROV-N using the custom renderers.
+
+    The report can also include the lineage of the CodeRun by passing `lineage=upstream` (the runs which produced its
+    inputs, and so on), `lineage=downstream` (the runs which used its outputs, and so on) or `lineage=both`, along with
+    the number of runs away to follow the links as `depth` (1 by default).
+
+    Images are rendered in the background. If an image is not ready in time the response is an empty 202 with the URL
+    to request it again in `Location`, and 503 if too many images are already waiting to be rendered.
     """
+    LINEAGE_DIRECTIONS = ('upstream', 'downstream', 'both')
+
+    # Maximum number of runs away from the run that the lineage can be followed
+    LINEAGE_MAX_DEPTH = 10
 
     def get(self, request, pk, format=None):
         code_run = get_object_or_404(models.CodeRun, pk=pk)
-        doc = generate_prov_document(code_run)
-        value = serialize_prov_document(doc, request.accepted_renderer.format)
+        lineage = request.query_params.get('lineage')
+        if lineage is None:
+            records = generate_prov_records(code_run)
+            return self.report_response(request, code_run, records)
+        if lineage not in self.LINEAGE_DIRECTIONS:
+            raise BadQuery(detail='Invalid lineage %s, lineage can only be [%s]' % (
+                lineage, ', '.join(self.LINEAGE_DIRECTIONS)))
+        depth = request.query_params.get('depth', '1')
+        if not depth.isdigit() or not 1 <= int(depth) <= self.LINEAGE_MAX_DEPTH:
+            raise BadQuery(detail='Invalid depth %s, depth must be from 1 to %d' % (depth, self.LINEAGE_MAX_DEPTH))
+        related_runs = find_lineage(code_run, upstream=lineage != 'downstream', downstream=lineage != 'upstream',
+                                    depth=int(depth))
+        records = generate_prov_records(code_run, related_runs)
+        return self.report_response(request, code_run, records, '%s:%s' % (lineage, depth))
+
+    def report_response(self, request, code_run, records, variant=''):
+        """
+        Return the response for the report of the given PROV records in the requested format.
+        """
+        retry_after = {'Retry-After': str(IMAGE_RENDER_WAIT)}
+        try:
+            value = render_prov_report(code_run, records, request.accepted_renderer.format, variant)
+        except RenderPending:
+            headers = dict(retry_after, Location=request.build_absolute_uri())
+            return Response(b'', status=status.HTTP_202_ACCEPTED, headers=headers)
+        except RenderBusy:
+            return Response(b'', status=status.HTTP_503_SERVICE_UNAVAILABLE, headers=retry_after)
+        except RenderError as ex:
+            raise BadQuery(detail='Could not render report: %s' % ex)
         return Response(value)
 
 
+class RegisterDataProductView(views.APIView):
+    """
+    API view for registering a `DataProduct` in a single request.
+
+    Creates the `StorageLocation`, `Object`, `DataProduct` and `ObjectComponents` for the data product, and the
+    `Namespace` if it does not already exist, in a single transaction so that nothing is created if any part fails.
+
+    ### Fields:
+    `namespace`: Name of the `Namespace` of the `DataProduct`, which is created if it does not exist
+
+    `name`: Name of the `DataProduct`
+
+    `version`: Version identifier of the `DataProduct`, must conform to semantic versioning syntax
+
+    `storage_root`: API URL of the `StorageRoot` the data product is stored in
+
+    `path`: Path of the data product relative to the `StorageRoot`
+
+    `hash`: SHA1 hash of the data product file
+
+    `description` (*optional*): Free text description of the `Object`
+
+    `components` (*optional*): List of the `ObjectComponents` of the data product, each given as a `name` and
+    optional `description`
+    """
+    authentication_classes = [SessionAuthentication, BasicAuthentication, TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = serializers.RegisterDataProductSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        user = request.user
+        try:
+            with transaction.atomic():
+                namespace, _ = models.Namespace.objects.get_or_create(name=data['namespace'],
+                                                                      defaults={'updated_by': user})
+                storage_location = models.StorageLocation.objects.create(
+                    storage_root=data['storage_root'], path=data['path'], hash=data['hash'], updated_by=user)
+                obj = models.Object.objects.create(
+                    storage_location=storage_location, description=data.get('description'), updated_by=user)
+                data_product = models.DataProduct.objects.create(
+                    object=obj, namespace=namespace, name=data['name'], version=data['version'], updated_by=user)
+                models.ObjectComponent.objects.bulk_create([
+                    models.ObjectComponent(object=obj, name=component['name'],
+                                           description=component.get('description'), updated_by=user)
+                    for component in data.get('components', [])
+                ])
+                bump_generation(models.ObjectComponent)
+        except IntegrityError as ex:
+            raise APIIntegrityError(str(ex))
+        component_ids = models.ObjectComponent.objects.filter(object=obj).order_by('id').values_list('id', flat=True)
+        return Response({
+            'namespace': reverse('namespace-detail', kwargs={'pk': namespace.pk}, request=request),
+            'storage_location': reverse('storagelocation-detail', kwargs={'pk': storage_location.pk}, request=request),
+            'object': reverse('object-detail', kwargs={'pk': obj.pk}, request=request),
+            'data_product': reverse('dataproduct-detail', kwargs={'pk': data_product.pk}, request=request),
+            'components': [
+                reverse('objectcomponent-detail', kwargs={'pk': pk}, request=request) for pk in component_ids
+            ],
+        }, status=status.HTTP_201_CREATED)
+
+
+class CodeRunManifestView(views.APIView):
+    """
+    API view for registering a `CodeRun` along with its submission script, inputs and outputs in a single request.
+
+    Inputs and outputs are given by the API URL of their `Object` and their name. Existing `ObjectComponents` are
+    used where they exist and the others are created. Everything is created in a single transaction so that nothing is
+    created if any part fails.
+
+    ### Fields:
+    `run_date`: datetime of the `CodeRun`
+
+    `description`: Free text description of the `CodeRun`
+
+    `code_repo` (*optional*): API URL of the `Object` associated with the `CodeRepoRelease` that was run
+
+    `model_config` (*optional*): API URL of the `Object` for the configuration used for the `CodeRun`
+
+    `submission_script`: API URL of the `Object` for the submission script used for the `CodeRun`
+
+    `submission_script_text`: Text of the submission script, which is stored as a `TextFile`, if `submission_script`
+    is not given
+
+    `inputs` (*optional*): List of the `ObjectComponents` that the `CodeRun` used as inputs, each given as the
+    `object` URL and `name`
+
+    `outputs` (*optional*): List of the `ObjectComponents` that the `CodeRun` produced as outputs, each given as the
+    `object` URL and `name`
+    """
+    authentication_classes = [SessionAuthentication, BasicAuthentication, TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = serializers.CodeRunManifestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        user = request.user
+        inputs = data.get('inputs', [])
+        outputs = data.get('outputs', [])
+
+        urls = [data[name] for name in ('code_repo', 'model_config', 'submission_script') if data.get(name)]
+        urls += [reference['object'] for reference in inputs + outputs]
+        object_ids = {url: get_pk_from_url(url, models.Object) for url in urls}
+        found = models.Object.objects.filter(pk__in=set(object_ids.values())).values_list('pk', flat=True)
+        missing = sorted(url for url, pk in object_ids.items() if pk not in set(found))
+        if missing:
+            raise BadQuery(detail='Objects not found [%s]' % ', '.join(missing))
+
+        try:
+            with transaction.atomic():
+                if 'submission_script_text' in data:
+                    submission_script_id = self.create_text_file_object(request, data['submission_script_text']).pk
+                else:
+                    submission_script_id = object_ids[data['submission_script']]
+                code_run = models.CodeRun.objects.create(
+                    run_date=data['run_date'],
+                    description=data['description'],
+                    code_repo_id=object_ids.get(data.get('code_repo')),
+                    model_config_id=object_ids.get(data.get('model_config')),
+                    submission_script_id=submission_script_id,
+                    updated_by=user,
+                )
+                component_ids = self.get_or_create_components(
+                    {(object_ids[reference['object']], reference['name']) for reference in inputs + outputs}, user)
+                for field_name, references in (('inputs', inputs), ('outputs', outputs)):
+                    ids = [component_ids[(object_ids[reference['object']], reference['name'])]
+                           for reference in references]
+                    self.add_components(code_run, field_name, ids)
+        except IntegrityError as ex:
+            raise APIIntegrityError(str(ex))
+        serializer = serializers.CodeRunSerializer(code_run, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def create_text_file_object(request, text):
+        """
+        Store the given text as a `TextFile` and return a new `Object` referencing it through the `text_file`
+        `StorageRoot`, which is created if it does not exist.
+        """
+        user = request.user
+        text_file = models.TextFile.objects.create(text=text, updated_by=user)
+        storage_root, _ = models.StorageRoot.objects.get_or_create(
+            name='text_file',
+            defaults={'root': request.build_absolute_uri(reverse('textfile-list')), 'updated_by': user},
+        )
+        storage_location = models.StorageLocation.objects.create(
+            storage_root=storage_root,
+            path='%d/?format=text' % text_file.pk,
+            hash=sha1(text.encode('utf-8')).hexdigest(),
+            updated_by=user,
+        )
+        return models.Object.objects.create(storage_location=storage_location, updated_by=user)
+
+    @staticmethod
+    def get_or_create_components(keys, user):
+        """
+        Return a dict mapping each of the given (object id, name) pairs to the id of the `ObjectComponent`, creating
+        any that do not already exist.
+        """
+        def find():
+            components = models.ObjectComponent.objects.filter(
+                object_id__in={object_id for object_id, _ in keys},
+                name__in={name for _, name in keys},
+            ).values_list('object_id', 'name', 'id')
+            return {(object_id, name): pk for object_id, name, pk in components}
+
+        component_ids = find()
+        missing = [key for key in keys if key not in component_ids]
+        if missing:
+            models.ObjectComponent.objects.bulk_create([
+                models.ObjectComponent(object_id=object_id, name=name, updated_by=user) for object_id, name in missing
+            ])
+            bump_generation(models.ObjectComponent)
+            component_ids = find()
+        return component_ids
+
+    @staticmethod
+    def add_components(code_run, field_name, component_ids):
+        """
+        Add the `ObjectComponents` with the given ids to the inputs or outputs of the `CodeRun` using a bulk insert.
+        """
+        field = models.CodeRun._meta.get_field(field_name)
+        through = field.remote_field.through
+        rows = through.objects.bulk_create([
+            through(**{field.m2m_field_name(): code_run, field.m2m_reverse_name(): pk})
+            for pk in dict.fromkeys(component_ids)
+        ])
+        links_created(through, rows)
+        bump_generation(models.ObjectComponent)
+
+
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API views (GET only) for the User model.
@@ -153,6 +430,18 @@ class APIIntegrityError(exceptions.APIException):
     default_code = 'integrity_error'
 
 
+def integrity_error(model, ex):
+    """
+    Return the APIIntegrityError for an IntegrityError raised when saving an object of the given model. If a field
+    which must be unique on its own is identified in the database's error message the error names the field, as it
+    did when uniqueness was validated by the serializer, otherwise it gives the database's message.
+    """
+    name = unique_violation(model, ex)
+    if name is not None:
+        return APIIntegrityError('Field %s must be unique' % name)
+    return APIIntegrityError(str(ex))
+
+
 class RegexFilter(filters.Filter):
     """
     Custom API filter which can be used to add regex filtering to a field.
@@ -205,6 +494,27 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
     default_filter_set = CustomFilterSet
 
 
+class CustomOrderingFilter(OrderingFilter):
+    """
+    Custom ordering filter allowing results to be ordered by a single field from the model's ORDERING_FIELDS, with the
+    id used as a tie-breaker so that cursor pagination can page through the results using an index.
+    """
+    def get_ordering(self, request, queryset, view):
+        param = request.query_params.get(self.ordering_param)
+        if not param:
+            return self.get_default_ordering(view)
+        field = param[1:] if param.startswith('-') else param
+        if field not in view.model.ORDERING_FIELDS:
+            args = ', '.join(view.model.ORDERING_FIELDS)
+            raise BadQuery(detail='Invalid ordering %s, results can only be ordered by [%s]' % (param, args))
+        if field == 'id':
+            return (param,)
+        return (param, '-id' if param.startswith('-') else 'id')
+
+    def get_valid_fields(self, queryset, view, context={}):
+        return [(field, field) for field in view.model.ORDERING_FIELDS]
+
+
 class BaseViewSet(mixins.CreateModelMixin,
                   mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
@@ -215,43 +525,413 @@ class BaseViewSet(mixins.CreateModelMixin,
     """
     authentication_classes = [SessionAuthentication, BasicAuthentication, TokenAuthentication]
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [CustomDjangoFilterBackend]
+    filter_backends = [CustomDjangoFilterBackend, CustomOrderingFilter]
+    ordering = ('-id',)
     # lookup_field = 'name'
+    # Query arguments accepted by list requests in addition to the model's filter fields
+    QUERY_PARAMS = ('cursor', 'format', 'fields', 'omit', 'expand', 'relations', 'count', 'ordering')
 
-    def list(self, request, *args, **kwargs):
-        if self.model.FILTERSET_FIELDS == '__all__':
-            filterset_fields = self.model.field_names() + ('cursor', 'format')
+    # Number of rows loaded from the database at a time when exporting
+    EXPORT_CHUNK_SIZE = 1000
+
+    # Maximum number of objects that can be requested in one batch request
+    BATCH_MAX_SIZE = 1000
+
+    # Maximum number of objects that can be created in one request
+    BULK_MAX_SIZE = 10000
+
+    # Maximum number of levels of relations that can be expanded
+    EXPAND_MAX_DEPTH = 3
+
+    # Time in seconds that rendered responses are cached for, they are also invalidated whenever the data changes
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    def check_query_params(self, request, allowed=None):
+        """
+        Raise a BadQuery error if the request uses any query arguments other than those `allowed`, by default the
+        model's filter fields and the QUERY_PARAMS.
+        """
+        if allowed is not None:
+            filterset_fields = tuple(allowed)
+        elif self.model.FILTERSET_FIELDS == '__all__':
+            filterset_fields = self.model.field_names() + self.QUERY_PARAMS
         else:
-            filterset_fields = self.model.FILTERSET_FIELDS + ('cursor', 'format')
+            filterset_fields = self.model.FILTERSET_FIELDS + self.QUERY_PARAMS
         if set(request.query_params.keys()) - set(filterset_fields):
             args = ', '.join(filterset_fields)
             raise BadQuery(detail='Invalid query arguments, only query arguments [%s] are allowed' % args)
-        return super().list(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        self.check_query_params(request)
+        return self.conditional_response(request, None, super().list, *args, **kwargs)
+
+    def get_url_pk(self, kwargs):
+        """
+        Return the primary key of the object given in the URL, raising a 404 if it is not a valid key for the model.
+        """
+        try:
+            return self.model._meta.pk.to_python(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except DjangoValidationError:
+            raise Http404
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.get_url_pk(kwargs)
+        rows = self.model.objects.filter(pk=pk).values_list('last_updated', flat=True)
+        return self.conditional_response(request, rows.first(), super().retrieve, *args, **kwargs)
+
+    def get_table_models(self):
+        """
+        Return the models whose tables the response to a GET request depends on: the model, the models it links to and,
+        for each relation path given in `expand`, the models along the path and the models they link to.
+        """
+        table_models = related_models(self.model)
+        for path in self.get_expand():
+            model = self.model
+            for name in path.split('.'):
+                model = model._meta.get_field(name).related_model
+                table_models.extend(m for m in related_models(model) if m not in table_models)
+        return table_models
+
+    def conditional_response(self, request, last_updated, handler, *args, **kwargs):
+        """
+        Handle a GET request using the given handler, unless the client's cached copy of the response is still valid in
+        which case a 304 response is returned without running the query, or the response is in the server's cache.
+
+        The ETag is derived from the generations of the tables the response depends on, which change whenever any row
+        in them is added, changed or deleted, along with the request's path, its query arguments (in a normalised
+        order) and the `last_updated` of the requested object for a single object. No rows need to be read to build
+        it. Last-Modified is the latest of the times the tables last changed and the object's `last_updated`, rounded
+        up to a whole second. The ETag is also used as the key for caching the rendered response.
+        """
+        table_models = self.get_table_models()
+        key = (
+            get_generations(table_models), last_updated, request.build_absolute_uri(request.path),
+            sorted(request.query_params.lists()),
+            request.accepted_renderer.media_type,
+        )
+        key_hash = sha1(repr(key).encode('utf-8')).hexdigest()
+        etag = quote_etag(key_hash)
+        last_modified = get_last_changed(table_models)
+        if last_updated is not None:
+            last_modified = max(last_modified, last_updated.timestamp())
+        last_modified = math.ceil(last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.cached_response('api:%s:%s' % (self.model._meta.label_lower, key_hash), request, handler,
+                                            *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def cached_response(self, cache_key, request, handler, *args, **kwargs):
+        """
+        Return the response to the request from the cache if present, otherwise handle the request using the given
+        handler and cache the rendered response. Responses rendered for the browsable API are not cached as they
+        depend on the user.
+        """
+        if request.accepted_renderer.format == 'api':
+            return handler(request, *args, **kwargs)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response.add_post_render_callback(
+                lambda rendered: cache.set(cache_key, (rendered.content, rendered['Content-Type']), self.CACHE_TIMEOUT)
+            )
+        return response
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream all the objects matching the filters as newline delimited JSON, one object per line.
+        """
+        self.check_query_params(request)
+        # Links in the exported objects should point at the JSON API rather than carry the .ndjson suffix
+        self.format_kwarg = None
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(self._export_rows(queryset), content_type=NDJSONRenderer.media_type)
+
+    def _export_rows(self, queryset):
+        """
+        Generator yielding the serialized rows of the queryset.
+
+        The rows are read using a server-side cursor (where the database supports it) and their many relations are
+        prefetched a chunk at a time, so memory use does not grow with the size of the table.
+        """
+        serializer = self.get_serializer()
+        renderer = NDJSONRenderer()
+        lookups = get_plan(self.get_serializer_class(), self.get_selected_fields(), self.get_expand()).prefetch_related
+        chunk = []
+        for instance in queryset.iterator(chunk_size=self.EXPORT_CHUNK_SIZE):
+            chunk.append(instance)
+            if len(chunk) == self.EXPORT_CHUNK_SIZE:
+                yield self._export_chunk(chunk, lookups, serializer, renderer)
+                chunk = []
+        if chunk:
+            yield self._export_chunk(chunk, lookups, serializer, renderer)
+
+    @staticmethod
+    def _export_chunk(chunk, lookups, serializer, renderer):
+        prefetch_related_objects(chunk, *lookups)
+        return b''.join(renderer.render(serializer.to_representation(instance)) for instance in chunk)
+
+    @action(detail=False, methods=['get', 'post'], permission_classes=[permissions.AllowAny])
+    def batch(self, request, *args, **kwargs):
+        """
+        Return a list of objects in one request.
+
+        The objects are given either as a comma separated list of ids in the `ids` query argument of a GET request or as
+        a list of ids or API URLs in the body of a POST request. The objects are returned in `results` in the order
+        they were requested, with any ids that do not exist listed in `missing`.
+        """
+        if request.method == 'GET':
+            ids = request.query_params.get('ids')
+            requested = ids.split(',') if ids else []
+        else:
+            requested = request.data.get('ids') if isinstance(request.data, dict) else request.data
+            if not isinstance(requested, list):
+                raise BadQuery(detail='Batch requests must provide a list of ids or URLs')
+        if len(requested) > self.BATCH_MAX_SIZE:
+            raise BadQuery(detail='Batch requests are limited to %d objects' % self.BATCH_MAX_SIZE)
+        pks = [get_pk(value, self.model) for value in requested]
+        instances = self.get_queryset().in_bulk(set(pks))
+        serializer = self.get_serializer([instances[pk] for pk in pks if pk in instances], many=True)
+        return Response({
+            'results': serializer.data,
+            'missing': [pk for pk in pks if pk not in instances],
+        })
+
+    @action(detail=True, methods=['post'], url_path=r'(?P<relation>\w+)/(?P<operation>add|remove)',
+            url_name='relation')
+    def relation(self, request, relation, operation, *args, **kwargs):
+        """
+        Add objects to or remove them from a many-to-many relation of an object (e.g. the `inputs` of a `CodeRun` or
+        the `component_issues` of an `Issue`) without sending the whole list, by POSTing a list of ids or API URLs of
+        the related objects to `<relation>/add/` or `<relation>/remove/`. Only the links to the given objects are
+        changed. Responds with a 204.
+        """
+        try:
+            field = self.model._meta.get_field(relation)
+        except FieldDoesNotExist:
+            field = None
+        if field is None or not field.many_to_many:
+            names = [field.name for field in self.model._meta.get_fields() if field.many_to_many]
+            raise BadQuery(detail='Invalid relation %s, relation can only be [%s]' % (relation, ', '.join(names)))
+        related_model = field.related_model
+        if not isinstance(request.data, list):
+            raise BadQuery(detail='Must provide a list of ids or URLs')
+        if len(request.data) > self.BATCH_MAX_SIZE:
+            raise BadQuery(detail='Requests are limited to %d objects' % self.BATCH_MAX_SIZE)
+        pks = {get_pk(value, related_model) for value in request.data}
+        instance = get_object_or_404(self.model.objects.only('pk'), pk=self.get_url_pk(kwargs))
+        with transaction.atomic():
+            if operation == 'add':
+                missing = pks.difference(related_model.objects.filter(pk__in=pks).values_list('pk', flat=True))
+                if missing:
+                    raise BadQuery(detail='%s ids %s do not exist' % (
+                        related_model._meta.verbose_name, ', '.join(str(pk) for pk in sorted(missing))))
+                getattr(instance, relation).add(*pks)
+            else:
+                getattr(instance, relation).remove(*pks)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def is_read(self):
+        """
+        Return whether the request only reads data, in which case the query arguments controlling how the results are
+        serialized can be used.
+        """
+        return self.request.method in permissions.SAFE_METHODS or self.action == 'batch'
+
+    def get_relations(self):
+        """
+        Return how the object and its relations should be identified, either by `url` (the default) or by `id` if
+        requested using the `relations` query argument.
+        """
+        if not self.is_read():
+            return 'url'
+        relations = self.request.query_params.get('relations', 'url')
+        if relations not in ('url', 'id'):
+            raise BadQuery(detail='Invalid relations %s, relations can only be given as [url, id]' % relations)
+        return relations
+
+    def get_selected_fields(self):
+        """
+        Return the set of fields requested using the `fields` and `omit` query arguments, or None if all fields should
+        be returned. Field selection only applies to GET requests and batch reads.
+        """
+        if not self.is_read():
+            return None
+        fields = self.request.query_params.get('fields')
+        omit = self.request.query_params.get('omit')
+        if not fields and not omit:
+            return None
+        all_fields = get_plan(self.get_serializer_class()).field_names
+        if self.get_relations() == 'id':
+            all_fields = tuple('id' if name == 'url' else name for name in all_fields)
+        selected = set(fields.split(',')) if fields else set(all_fields)
+        omitted = set(omit.split(',')) if omit else set()
+        invalid = (selected | omitted) - set(all_fields)
+        if invalid:
+            raise BadQuery(detail='Invalid fields [%s], only fields [%s] are allowed' % (
+                ', '.join(sorted(invalid)), ', '.join(all_fields)))
+        return frozenset(selected - omitted)
+
+    def get_expand(self):
+        """
+        Return the set of relation paths requested using the `expand` query argument, e.g. `object.storage_location`
+        to return the object and its storage location nested in the results rather than as links. Like field
+        selection, expansion only applies to GET requests and batch reads.
+        """
+        if not self.is_read():
+            return frozenset()
+        expand = self.request.query_params.get('expand')
+        if not expand:
+            return frozenset()
+        paths = frozenset(expand.split(','))
+        for path in paths:
+            names = path.split('.')
+            if len(names) > self.EXPAND_MAX_DEPTH:
+                raise BadQuery(detail='Invalid expand %s, relations can only be expanded %d levels deep' % (
+                    path, self.EXPAND_MAX_DEPTH))
+            serializer_class = self.get_serializer_class()
+            for name in names:
+                model = serializer_class.Meta.model
+                try:
+                    related_model = model._meta.get_field(name).related_model
+                except FieldDoesNotExist:
+                    related_model = None
+                if name not in get_plan(serializer_class).field_names:
+                    related_model = None
+                if related_model not in models.all_models.values():
+                    raise BadQuery(detail='Invalid expand %s, %s is not a relation of %s' % (
+                        path, name, model._meta.verbose_name))
+                serializer_class = serializers.get_serializer_class(related_model)
+        return paths
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_selected_fields())
+        kwargs.setdefault('expand', self.get_expand())
+        kwargs.setdefault('relations', self.get_relations())
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
-        return self.model.objects.all()
+        return plan_queryset(self.model.objects.all(), self.get_serializer_class(), self.get_selected_fields(),
+                             self.get_expand(), extra_columns=self.model.ORDERING_FIELDS)
 
     def create(self, request, *args, **kwargs):
         """
-        Customising the create method to raise a 409 on uniqueness validation failing.
+        Customising the create method to create multiple objects if given a list, and to return or update an existing
+        object if requested using the `on_conflict` query argument.
+        """
+        on_conflict = request.query_params.get('on_conflict')
+        if on_conflict is not None:
+            return self.upsert(request, on_conflict)
+        if isinstance(request.data, list):
+            return self.bulk_create(request)
+        return super().create(request, *args, **kwargs)
+
+    def bulk_create(self, request):
+        """
+        Create all the objects in the list given in the request in a single transaction.
+
+        The list is validated as a whole, so if any of the objects are invalid nothing is created and a 400 response
+        is returned with a list of the errors for each object. Otherwise the created objects are returned in the same
+        order as they were given.
+        """
+        if len(request.data) > self.BULK_MAX_SIZE:
+            raise BadQuery(detail='Lists of objects are limited to %d objects' % self.BULK_MAX_SIZE)
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        instances = self.perform_create(serializer)
+        created = self.get_queryset().in_bulk([instance.pk for instance in instances])
+        serializer = self.get_serializer([created[instance.pk] for instance in instances], many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def upsert(self, request, on_conflict):
+        """
+        Create an object unless one with the same values for the fields of the model's unique constraint already
+        exists, in which case the existing object is returned (`on_conflict=get`) or updated (`on_conflict=update`).
+        Responds with a 201 if the object was created and a 200 otherwise.
         """
+        if on_conflict not in ('get', 'update'):
+            raise BadQuery(detail='Invalid on_conflict %s, on_conflict can only be [get, update]' % on_conflict)
+        if unique_fields(self.model) is None:
+            raise BadQuery(detail='on_conflict cannot be used for %s as it has no unique fields' %
+                                  self.model._meta.verbose_name)
+        if isinstance(request.data, list):
+            raise BadQuery(detail='on_conflict cannot be used when creating multiple objects')
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         try:
-            return super().create(request, *args, **kwargs)
-        except ValidationError as ex:
-            name = list(ex.detail.keys())[0]
-            if ex.detail[name][0].code == 'unique':
-                raise APIIntegrityError('Field ' + name + ' must be unique')
-            else:
-                raise ex
+            instance, created = upsert(self.model, dict(serializer.validated_data, updated_by=request.user),
+                                       update=on_conflict == 'update')
+        except IntegrityError as ex:
+            raise integrity_error(self.model, ex)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     def perform_create(self, serializer):
         """
-        Customising the save method to add the current user as the models updated_by.
+        Customising the save method to add the current user as the models updated_by, and to raise a 409 if this
+        violates a unique constraint.
         """
         try:
-            return serializer.save(updated_by=self.request.user)
+            with transaction.atomic():
+                return serializer.save(updated_by=self.request.user)
         except IntegrityError as ex:
-            raise APIIntegrityError(str(ex))
+            raise integrity_error(self.model, ex)
+
+
+class ImportJobListView(views.APIView):
+    """
+    API view for uploading a file of registry records to be imported in the background.
+
+    The file is queued and processed by the `process_imports` management command, in batches of rows which are each
+    imported in a single transaction. Rows that cannot be imported are skipped and their errors are reported in the
+    status of the job, which can be polled at the URL given in the response.
+
+    ### Fields:
+    `file`: A UTF-8 encoded JSON lines file (one JSON object per line) or CSV file with a header row giving the field
+    names. Each record gives the `type` of the object as the name of its API endpoint (e.g. `storage_root`) and its
+    fields as they would be POSTed to that endpoint
+
+    `type` (*optional*): The type of any records which do not give their own `type`
+
+    `file_format` (*optional*): `jsonl` or `csv`, by default taken from the file extension
+    """
+    authentication_classes = [SessionAuthentication, BasicAuthentication, TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise BadQuery(detail='A file of records must be uploaded as file')
+        file_format = request.data.get('file_format') or None
+        if file_format not in (None, models.ImportJob.JSONL, models.ImportJob.CSV):
+            raise BadQuery(detail='Invalid file_format %s, file_format can only be [%s, %s]' % (
+                file_format, models.ImportJob.JSONL, models.ImportJob.CSV))
+        record_type = request.data.get('type', '')
+        if record_type and record_type not in RECORD_TYPES:
+            raise BadQuery(detail='Invalid type %s' % record_type)
+        job = create_job(request.user, upload.name, upload, file_format, record_type)
+        serializer = serializers.ImportJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': serializer.data['url']})
+
+
+class ImportJobView(views.APIView):
+    """
+    API view returning the status of an import, with the number of rows processed so far, the number of rows that
+    failed, the rate rows are being processed, and the errors for the rows that failed.
+    """
+    authentication_classes = [SessionAuthentication, BasicAuthentication, TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(models.ImportJob, pk=pk, created_by=request.user)
+        serializer = serializers.ImportJobSerializer(job, context={'request': request})
+        return Response(serializer.data)
 
 
 class ObjectStorageView(views.APIView):
@@ -285,17 +965,123 @@ class ObjectStorageView(views.APIView):
         return HttpResponse(url)
 
 
-class IssueViewSet(BaseViewSet, mixins.UpdateModelMixin):
+class LineageMixin:
+    """
+    Mixin for the views of the models in the lineage table (`Object` and `CodeRun`), adding actions returning the
+    Objects and CodeRuns which an object depends on (`ancestors/`) or which depend on it (`descendants/`), directly or
+    through any number of runs.
+    """
+    # Query arguments accepted by the lineage actions
+    LINEAGE_QUERY_PARAMS = ('format', 'relations')
+
+    @action(detail=True)
+    def ancestors(self, request, *args, **kwargs):
+        """
+        Return the `Objects` and `CodeRuns` that this object depends on, i.e. the inputs of the runs that produced it,
+        the runs that produced those inputs, and so on.
+        """
+        return self.lineage_response('descendant', self.get_url_pk(kwargs))
+
+    @action(detail=True)
+    def descendants(self, request, *args, **kwargs):
+        """
+        Return the `Objects` and `CodeRuns` that depend on this object, i.e. the runs that used it as an input, the
+        outputs of those runs, and so on.
+        """
+        return self.lineage_response('ancestor', self.get_url_pk(kwargs))
+
+    def lineage_response(self, role, pk):
+        self.check_query_params(self.request, self.LINEAGE_QUERY_PARAMS)
+        instance = get_object_or_404(self.model.objects.only('pk'), pk=pk)
+        node_type = models.LineageLink.OBJECT if self.model is models.Object else models.LineageLink.CODE_RUN
+        lineage = get_lineage(node_type, instance.pk, role)
+        if self.get_relations() == 'id':
+            return Response({'objects': lineage[models.LineageLink.OBJECT],
+                             'code_runs': lineage[models.LineageLink.CODE_RUN]})
+        return Response({
+            'objects': self.lineage_urls('object-detail', lineage[models.LineageLink.OBJECT]),
+            'code_runs': self.lineage_urls('coderun-detail', lineage[models.LineageLink.CODE_RUN]),
+        })
+
+    def lineage_urls(self, view_name, ids):
+        template = reverse(view_name, kwargs={'pk': PK_PLACEHOLDER}, request=self.request)
+        return [template.replace(PK_PLACEHOLDER, str(pk)) for pk in ids]
+
+
+class ImpactMixin:
+    """
+    Mixin for the views of `Issues` and of the models that issues are attached to (`Object` and `ObjectComponent`),
+    adding an `impact/` action returning everything downstream of the issues.
+    """
+    IMPACT_VIEW_NAMES = {
+        models.LineageLink.OBJECT: 'object-detail',
+        models.LineageLink.CODE_RUN: 'coderun-detail',
+        OBJECT_COMPONENT: 'objectcomponent-detail',
+    }
+    # Query arguments accepted by the impact action
+    IMPACT_QUERY_PARAMS = ('format', 'relations', 'page')
+
+    @action(detail=True)
+    def impact(self, request, *args, **kwargs):
+        """
+        Return the `CodeRuns` that used the objects or components with the issue (or with issues, for an `Object` or
+        `ObjectComponent`) as inputs, directly or through other runs, along with their outputs and the `Objects` of
+        those outputs. Each is given with its `type` and the maximum `severity` of the issues affecting it, in order of
+        decreasing severity.
+        """
+        self.check_query_params(request, self.IMPACT_QUERY_PARAMS)
+        instance = get_object_or_404(self.model.objects.only('pk'), pk=self.get_url_pk(kwargs))
+        objects, components = self.get_impact_roots(instance)
+        paginator = pagination.PageNumberPagination()
+        page = paginator.paginate_queryset(get_impact(objects, components), request, view=self)
+        relations = self.get_relations()
+        templates = dict(
+            (node_type, reverse(view_name, kwargs={'pk': PK_PLACEHOLDER}, request=request))
+            for node_type, view_name in self.IMPACT_VIEW_NAMES.items()
+        )
+        results = []
+        for node_type, node_id, severity in page:
+            if relations == 'id':
+                results.append({'type': node_type, 'id': node_id, 'severity': severity})
+            else:
+                url = templates[node_type].replace(PK_PLACEHOLDER, str(node_id))
+                results.append({'type': node_type, 'url': url, 'severity': severity})
+        return paginator.get_paginated_response(results)
+
+    def get_impact_roots(self, instance):
+        """
+        Return dicts of the severity of the issues with each `Object` and `ObjectComponent` to find the impact of.
+        """
+        if self.model is models.Issue:
+            severity = models.Issue.objects.values_list('severity', flat=True).get(pk=instance.pk)
+            objects = dict.fromkeys(instance.object_issues.values_list('pk', flat=True), severity)
+            components = dict.fromkeys(instance.component_issues.values_list('pk', flat=True), severity)
+            return objects, components
+        if self.model is models.Object:
+            severity = instance.issues.aggregate(severity=Max('severity'))['severity']
+            objects = {instance.pk: severity} if severity is not None else {}
+            components = dict(models.ObjectComponent.objects.filter(object=instance, issues__isnull=False)
+                              .values('pk').annotate(severity=Max('issues__severity')).values_list('pk', 'severity'))
+            return objects, components
+        severity = instance.issues.aggregate(severity=Max('severity'))['severity']
+        return {}, {instance.pk: severity} if severity is not None else {}
+
+
+class IssueViewSet(ImpactMixin, BaseViewSet, mixins.UpdateModelMixin):
     model = models.Issue
     serializer_class = serializers.IssueSerializer
     filterset_fields = models.Issue.FILTERSET_FIELDS
     __doc__ = models.Issue.__doc__
 
     def create(self, request, *args, **kwargs):
-        if 'object_issues' not in request.data:
-            request.data['object_issues'] = []
-        if 'component_issues' not in request.data:
-            request.data['component_issues'] = []
+        for data in request.data if isinstance(request.data, list) else [request.data]:
+            if not isinstance(data, dict):
+                # Left for the serializer to report as invalid
+                continue
+            if 'object_issues' not in data:
+                data['object_issues'] = []
+            if 'component_issues' not in data:
+                data['component_issues'] = []
         return super().create(request, *args, **kwargs)
 
 
@@ -310,5 +1096,10 @@ for name, cls in models.all_models.items():
     }
     if name == 'TextFile':
         data['renderer_classes'] = BaseViewSet.renderer_classes + [TextRenderer]
-    globals()[name + "ViewSet"] = type(name + "ViewSet", (BaseViewSet,), data)
+    bases = (BaseViewSet,)
+    if name in ('Object', 'CodeRun'):
+        bases = (LineageMixin,) + bases
+    if name in ('Object', 'ObjectComponent'):
+        bases = (ImpactMixin,) + bases
+    globals()[name + "ViewSet"] = type(name + "ViewSet", bases, data)
 
@@ -1,8 +1,30 @@
-from django.test import TestCase
-from django.urls import reverse
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, set_script_prefix
+from django.utils import timezone
+from django.utils.http import parse_http_date
 from django.contrib.auth import get_user_model
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.test import APIClient
 
+from data_management.models import CodeRun, DataProduct, ImportJob, Issue, LineageLink, Namespace, Object, \
+    ObjectComponent, ProvReport, StorageLocation, StorageRoot, TextFile
+from data_management import prov
+from data_management.imports import STALE_JOB_TIMEOUT, claim_job, create_job
+from data_management.rest.pagination import CustomPagination
 from .initdb import init_db
 
 
@@ -109,6 +131,67 @@ class StorageRootAPITests(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertEqual(response.json()['name'], 'https://jptcp.com/')
 
+    def test_create_duplicate(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('storageroot-list')
+        existing = StorageRoot.objects.get(name='DataRepository')
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(url, {'name': 'NewRoot', 'root': existing.root}, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {'detail': 'Field root must be unique'})
+        selects = [query['sql'] for query in context.captured_queries if 'storageroot' in query['sql']
+                   and query['sql'].startswith('SELECT')]
+        self.assertEqual(selects, [])
+
+        response = client.post(url, {'name': 'DataRepository', 'root': 'https://example.com/'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {'detail': 'Field name must be unique'})
+
+    def test_create_on_conflict_get(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('storageroot-list')
+        existing = StorageRoot.objects.get(name='DataRepository')
+        data = {'name': 'DataRepository', 'root': existing.root, 'accessibility': 1}
+        response = client.post(url + '?on_conflict=get', data, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['url'], 'http://testserver/api/storage_root/%d/' % existing.id)
+        self.assertEqual(response.json()['accessibility'], 0)
+
+        data = {'name': 'NewRoot', 'root': 'https://example.com/'}
+        response = client.post(url + '?on_conflict=get', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(StorageRoot.objects.get(name='NewRoot').root, 'https://example.com/')
+
+    def test_create_on_conflict_update(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('storageroot-list')
+        existing = StorageRoot.objects.get(name='DataRepository')
+        data = {'name': 'DataRepository', 'root': existing.root, 'accessibility': 1}
+        response = client.post(url + '?on_conflict=update', data, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['url'], 'http://testserver/api/storage_root/%d/' % existing.id)
+        self.assertEqual(StorageRoot.objects.get(pk=existing.id).accessibility, 1)
+
+        # Fields which are not given keep their values
+        data = {'name': 'DataRepository', 'root': existing.root}
+        response = client.post(url + '?on_conflict=update', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StorageRoot.objects.get(pk=existing.id).accessibility, 1)
+
+    def test_create_on_conflict_invalid(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('storageroot-list')
+        response = client.post(url + '?on_conflict=ignore', {'name': 'DataRepository'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
     def test_filter_by_name(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -196,6 +279,64 @@ class StorageLocationAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['path'], 'human/infection/SARS-CoV-2/scotland/cases_and_management/v0.1.0.h5')
 
+    def test_count_is_cached(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('storagelocation-list')
+        with CaptureQueriesContext(connection) as first:
+            response = client.get(url, data={'fields': 'path'}, format='json')
+        self.assertEqual(response.json()['count'], 18)
+        self.assertTrue(response.json()['count_exact'])
+        with CaptureQueriesContext(connection) as second:
+            response = client.get(url, data={'fields': 'path,hash'}, format='json')
+        self.assertEqual(response.json()['count'], 18)
+        self.assertEqual(len(second.captured_queries), len(first.captured_queries) - 1)
+
+        StorageLocation.objects.create(
+            updated_by=self.user,
+            path='path/to/new/file',
+            hash='0123456789abcdef',
+            storage_root=StorageRoot.objects.get(name='boydorr'),
+        )
+        response = client.get(url, format='json')
+        self.assertEqual(response.json()['count'], 19)
+        response = client.get(url, data={'hash': '0123456789abcdef'}, format='json')
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_count_disabled(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('storagelocation-list')
+        response = client.get(url, data={'count': 'false'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['count'])
+        self.assertFalse(response.json()['count_exact'])
+        self.assertEqual(len(response.json()['results']), 18)
+
+    def test_export(self):
+        client = APIClient()
+        url = reverse('storagelocation-export')
+        response = client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 18)
+        self.assertEqual(json.loads(lines[-1])['url'], 'http://testserver/api/storage_location/1/')
+
+    def test_export_filtered(self):
+        client = APIClient()
+        url = reverse('storagelocation-export')
+        response = client.get(url, data={'hash': '43faf6d048b92ed1820db2e662ba403eb0e371fb', 'fields': 'path'})
+
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [{'path': 'human/infection/SARS-CoV-2/scotland/cases_and_management/v0.1.0.h5'}]
+        )
+
 
 class ObjectAPITests(TestCase):
 
@@ -224,6 +365,35 @@ class ObjectAPITests(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertEqual(response.json()['storage_location'], 'http://testserver/api/storage_location/2/')
 
+    def test_get_detail_relation_ids(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('object-detail', kwargs={'pk': 3})
+        response = client.get(url, data={'relations': 'id', 'fields': 'id,storage_location,components'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id': 3, 'storage_location': 2, 'components': [2]})
+
+    def test_get_list_relation_ids_expanded(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('object-list')
+        data = {'relations': 'id', 'fields': 'id,storage_location', 'expand': 'storage_location', 'storage_location': 2}
+        response = client.get(url, data=data, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        storage_location = response.json()['results'][0]['storage_location']
+        self.assertEqual(storage_location['id'], 2)
+        self.assertEqual(storage_location['storage_root'], 2)
+
+    def test_invalid_relations(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('object-list')
+        response = client.get(url, data={'relations': 'name'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
     def test_filter_by_storage_location(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -236,6 +406,48 @@ class ObjectAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['storage_location'], 'http://testserver/api/storage_location/3/')
 
+    def test_get_list_query_count(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('object-list')
+        with CaptureQueriesContext(connection) as single:
+            client.get(url, data={'storage_location': '3'}, format='json')
+        with CaptureQueriesContext(connection) as full:
+            response = client.get(url, format='json')
+
+        self.assertEqual(len(response.json()['results']), 16)
+        self.assertEqual(len(full.captured_queries), len(single.captured_queries))
+
+    def test_get_detail_related_fields(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('object-detail', kwargs={'pk': 2})
+        response = client.get(url, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['data_product'], 'http://testserver/api/data_product/1/')
+        self.assertEqual(data['components'], ['http://testserver/api/object_component/1/'])
+        self.assertEqual(data['code_repo_release'], None)
+        self.assertEqual(data['authors'], [])
+
+    def test_omit_fields(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('object-list')
+        with CaptureQueriesContext(connection) as full:
+            client.get(url, format='json')
+        omit = 'components,authors,licences,keywords,issues,data_product,code_repo_release'
+        with CaptureQueriesContext(connection) as narrow:
+            response = client.get(url, data={'omit': omit}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 16)
+        self.assertNotIn('components', results[0])
+        self.assertIn('storage_location', results[0])
+        self.assertLess(len(narrow.captured_queries), len(full.captured_queries))
+
 
 class ObjectComponentAPITests(TestCase):
 
@@ -276,6 +488,132 @@ class ObjectComponentAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['name'], 'nhs_health_board/per_location/all_deaths')
 
+    def test_order_by_name(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('objectcomponent-list')
+        expected = list(ObjectComponent.objects.order_by('name', 'id').values_list('id', flat=True))
+        ids = []
+        with mock.patch.object(CustomPagination, 'page_size', 5):
+            response = client.get(url, data={'ordering': 'name'}, format='json')
+            while True:
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+                ids.extend(int(result['url'].split('/')[-2]) for result in data['results'])
+                if not data['next']:
+                    break
+                penultimate_page = data
+                response = client.get(data['next'], format='json')
+
+            self.assertEqual(ids, expected)
+            response = client.get(penultimate_page['previous'], format='json')
+            previous_ids = [int(result['url'].split('/')[-2]) for result in response.json()['results']]
+            self.assertEqual(previous_ids, expected[-len(data['results']) - 10:-len(data['results']) - 5])
+
+    def test_order_by_invalid_field(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('objectcomponent-list')
+        response = client.get(url, data={'ordering': 'description'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('objectcomponent-list')
+        data = [
+            {'object': 'http://testserver/api/object/1/', 'name': 'bulk-%d' % i,
+             'issues': ['http://testserver/api/issue/1/']}
+            for i in range(3)
+        ]
+        response = client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['name'] for result in response.json()], ['bulk-0', 'bulk-1', 'bulk-2'])
+        self.assertEqual(response.json()[0]['issues'], ['http://testserver/api/issue/1/'])
+        self.assertEqual(ObjectComponent.objects.filter(name__startswith='bulk-', updated_by=self.user).count(), 3)
+
+    def test_bulk_create_resolves_urls_together(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('objectcomponent-list')
+        query_counts = []
+        for size in (2, 20):
+            data = [
+                {'object': 'http://testserver/api/object/%d/' % (i % 3 + 1), 'name': 'bulk-%d-%d' % (size, i),
+                 'issues': ['http://testserver/api/issue/1/', 'http://testserver/api/issue/2/']}
+                for i in range(size)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 201)
+            # Count the queries made validating the list, before the objects are saved
+            sql = [query['sql'] for query in queries]
+            query_counts.append(next(i for i, statement in enumerate(sql) if not statement.startswith('SELECT')))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        component = ObjectComponent.objects.get(name='bulk-20-19')
+        self.assertEqual(component.object_id, 2)
+        self.assertEqual(set(component.issues.values_list('pk', flat=True)), {1, 2})
+
+    def test_bulk_create_invalid(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('objectcomponent-list')
+        data = [
+            {'object': 'http://testserver/api/object/1/', 'name': 'bulk-valid'},
+            {'object': 'http://testserver/api/object/1/'},
+        ]
+        response = client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertIn('name', response.json()[1])
+        self.assertFalse(ObjectComponent.objects.filter(name='bulk-valid').exists())
+
+    def test_batch_get(self):
+        client = APIClient()
+        url = reverse('objectcomponent-batch')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, data={'ids': '3,1,999', 'fields': 'name'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.json(), {
+            'results': [{'name': ObjectComponent.objects.get(pk=3).name}, {'name': 'symptom-probability'}],
+            'missing': [999],
+        })
+
+    def test_batch_post_urls(self):
+        client = APIClient()
+        url = reverse('objectcomponent-batch')
+        urls = ['http://testserver/api/object_component/2/', 'http://testserver/api/object_component/1/']
+        response = client.post(url + '?fields=url', urls, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [{'url': url} for url in urls], 'missing': []})
+
+    def test_batch_post_urls_with_script_prefix(self):
+        client = APIClient()
+        url = reverse('objectcomponent-batch')
+        set_script_prefix('/registry/')
+        try:
+            response = client.post(url + '?relations=id', ['http://testserver/registry/api/object_component/2/'],
+                                   format='json')
+        finally:
+            set_script_prefix('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['id'] for result in response.json()['results']], [2])
+
+    def test_batch_post_invalid_url(self):
+        client = APIClient()
+        url = reverse('objectcomponent-batch')
+        response = client.post(url, ['http://testserver/api/object/1/'], format='json')
+
+        self.assertEqual(response.status_code, 400)
+
 
 class IssueAPITests(TestCase):
 
@@ -304,6 +642,16 @@ class IssueAPITests(TestCase):
         self.assertEqual(response['Content-Type'], 'application/json')
         self.assertEqual(response.json()['description'], 'Test Issue 1')
 
+    def test_create_list_with_invalid_item(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('issue-list')
+        response = client.post(url, ['x', {'severity': 4, 'description': 'Valid issue'}], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()), 2)
+        self.assertFalse(Issue.objects.filter(description='Valid issue').exists())
+
     def test_filter_by_severity(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -316,6 +664,33 @@ class IssueAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['description'], 'Test Issue 2')
 
+    def test_add_component_issues(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('issue-relation', kwargs={'pk': 1, 'relation': 'component_issues', 'operation': 'add'})
+        response = client.post(url, [5, 6], format='json')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertTrue({5, 6}.issubset(ObjectComponent.objects.filter(issues=1).values_list('pk', flat=True)))
+
+    def test_add_missing_component_issues(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('issue-relation', kwargs={'pk': 1, 'relation': 'component_issues', 'operation': 'add'})
+        response = client.post(url, [5, 9999], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'object component ids 9999 do not exist'})
+        self.assertFalse(ObjectComponent.objects.filter(issues=1, pk=5).exists())
+
+    def test_add_invalid_relation(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('issue-relation', kwargs={'pk': 1, 'relation': 'severity', 'operation': 'add'})
+        response = client.post(url, [5], format='json')
+
+        self.assertEqual(response.status_code, 400)
+
 
 class CodeRunAPITests(TestCase):
 
@@ -368,6 +743,473 @@ class CodeRunAPITests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['description'], 'Script run to upload and process scottish coronavirus-covid-19-management-information')
 
+    def _create_with_inputs(self, client, inputs):
+        data = {
+            'run_date': '2020-07-17T18:21:11Z',
+            'description': 'Test run',
+            'submission_script': 'http://testserver/api/object/1/',
+            'inputs': inputs,
+        }
+        return client.post(reverse('coderun-list'), data, format='json')
+
+    def test_create_query_count_independent_of_inputs(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        component_urls = ['http://testserver/api/object_component/%d/' % pk
+                          for pk in ObjectComponent.objects.values_list('pk', flat=True)]
+        # Make one request first so that anything cached on the first request (e.g. the current site) is cached
+        self._create_with_inputs(client, component_urls[:1])
+        query_counts = []
+        for inputs in (component_urls[:1], component_urls):
+            with CaptureQueriesContext(connection) as context:
+                response = self._create_with_inputs(client, inputs)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(sorted(response.json()['inputs']), sorted(inputs))
+            query_counts.append(len(context.captured_queries))
+
+        self.assertGreater(len(component_urls), 10)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_create_reports_all_invalid_inputs(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        inputs = [
+            'http://testserver/api/object_component/1/',
+            'http://testserver/api/object_component/9999/',
+            'http://testserver/api/object/1/',
+            'http://testserver/api/object_component/9998/',
+        ]
+        response = self._create_with_inputs(client, inputs)
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['inputs']
+        self.assertEqual(len(errors), 3)
+        self.assertIn('http://testserver/api/object_component/9999/', errors[0])
+        self.assertIn('http://testserver/api/object/1/', errors[1])
+        self.assertIn('http://testserver/api/object_component/9998/', errors[2])
+        self.assertFalse(CodeRun.objects.filter(description='Test run').exists())
+
+    def test_add_and_remove_inputs(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        code_run = CodeRun.objects.get(pk=1)
+        inputs = set(code_run.inputs.values_list('pk', flat=True))
+        new_input = ObjectComponent.objects.exclude(pk__in=inputs).first()
+        url = reverse('coderun-relation', kwargs={'pk': 1, 'relation': 'inputs', 'operation': 'add'})
+        response = client.post(url, ['http://testserver/api/object_component/%d/' % new_input.pk], format='json')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(set(code_run.inputs.values_list('pk', flat=True)), inputs | {new_input.pk})
+
+        url = reverse('coderun-relation', kwargs={'pk': 1, 'relation': 'inputs', 'operation': 'remove'})
+        response = client.post(url, [new_input.pk], format='json')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(set(code_run.inputs.values_list('pk', flat=True)), inputs)
+
+    def test_add_inputs_not_found(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        for pk in (999, 'abc'):
+            url = reverse('coderun-relation', kwargs={'pk': pk, 'relation': 'inputs', 'operation': 'add'})
+            response = client.post(url, [1], format='json')
+            self.assertEqual(response.status_code, 404)
+
+
+class ProvReportAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='Test User')
+        init_db()
+
+    def test_get_json(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': 1})
+        response = client.get(url + '?format=json')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIn('/api/code_run/1', data['activity'])
+        self.assertEqual(data['entity']['/api/object/2']['namespace'], 'SCRC')
+
+    def test_report_is_stored(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': 1})
+        response = client.get(url + '?format=xml')
+
+        self.assertEqual(response.status_code, 200)
+        report = ProvReport.objects.get(code_run=1, format='xml')
+        self.assertEqual(bytes(report.content), response.content)
+
+        # The stored report is returned while the run's provenance is unchanged
+        ProvReport.objects.filter(pk=report.pk).update(content=b'<stored/>')
+        cache.clear()
+        response = client.get(url + '?format=xml')
+        self.assertEqual(response.content, b'<stored/>')
+
+        code_run = CodeRun.objects.get(pk=1)
+        code_run.description = 'Changed description'
+        code_run.save()
+        response = client.get(url + '?format=xml')
+        self.assertIn(b'Changed description', response.content)
+        self.assertEqual(bytes(ProvReport.objects.get(code_run=1, format='xml').content), response.content)
+
+    def test_revalidated_by_clients(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': 1})
+        for _ in range(2):
+            response = client.get(url + '?format=json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response['Cache-Control'].split(', ')), {'no-cache', 'max-age=0'})
+            self.assertFalse(response.has_header('Expires'))
+
+        response = client.get(url + '?format=json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        code_run = CodeRun.objects.get(pk=1)
+        code_run.description = 'Changed description'
+        code_run.save()
+        response = client.get(url + '?format=json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def _create_run(self, description, inputs=(), outputs=()):
+        code_run = CodeRun.objects.create(updated_by=self.user, run_date='2020-08-01T00:00:00Z',
+                                          description=description, submission_script=Object.objects.get(pk=1))
+        code_run.inputs.set(inputs)
+        code_run.outputs.set(outputs)
+        return code_run
+
+    def test_lineage(self):
+        code_run = CodeRun.objects.get(pk=1)
+        output_component = ObjectComponent.objects.create(updated_by=self.user, object=Object.objects.get(pk=1),
+                                                          name='lineage-output')
+        upstream_component = ObjectComponent.objects.create(updated_by=self.user, object=Object.objects.get(pk=1),
+                                                            name='lineage-input')
+        code_run.outputs.add(output_component)
+        upstream = self._create_run('upstream', inputs=[upstream_component], outputs=[code_run.inputs.first()])
+        further_upstream = self._create_run('further upstream', outputs=[upstream_component])
+        downstream = self._create_run('downstream', inputs=[output_component])
+
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': 1})
+        expected = {
+            ('upstream', 1): {code_run, upstream},
+            ('upstream', 2): {code_run, upstream, further_upstream},
+            ('downstream', 3): {code_run, downstream},
+            ('both', 1): {code_run, upstream, downstream},
+        }
+        for (lineage, depth), code_runs in expected.items():
+            response = client.get(url, {'format': 'json', 'lineage': lineage, 'depth': depth})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.json()['activity']), {'/api/code_run/%d' % run.id for run in code_runs})
+
+    def test_lineage_invalid(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': 1})
+
+        self.assertEqual(client.get(url, {'format': 'json', 'lineage': 'sideways'}).status_code, 400)
+        self.assertEqual(client.get(url, {'format': 'json', 'lineage': 'both', 'depth': '100'}).status_code, 400)
+
+    def test_records_match_prov_document(self):
+        code_run = CodeRun.objects.get(pk=1)
+        self._create_run('say "hello"\nsecond line', inputs=code_run.outputs.all(),
+                         outputs=[ObjectComponent.objects.last()])
+        related_runs = prov.find_lineage(code_run)
+        records = prov.generate_prov_records(code_run, related_runs)
+        doc = prov.generate_prov_document(code_run, related_runs)
+
+        self.assertEqual(json.dumps(prov.prov_json(records)),
+                         json.dumps(prov.serialize_prov_document(doc, 'json')))
+        self.assertEqual(prov.prov_n(records), prov.serialize_prov_document(doc, 'provn'))
+
+    def test_query_count_independent_of_inputs(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': 1})
+        query_counts = []
+        for components in (ObjectComponent.objects.none(), ObjectComponent.objects.all()):
+            CodeRun.objects.get(pk=1).inputs.add(*components)
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(url + '?format=json')
+            self.assertEqual(response.status_code, 200)
+            query_counts.append(len(context.captured_queries))
+
+        components = [name for name in response.json()['entity'] if name.startswith('/api/object_component/')]
+        self.assertEqual(len(components), ObjectComponent.objects.count())
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class ProvReportImageAPITests(TransactionTestCase):
+    """
+    Images are rendered and stored by the render pool's threads, so these tests cannot run inside a transaction.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='Test User')
+        init_db()
+        cache.clear()
+        # The tables are emptied rather than rolled back between tests, so ids are not reused
+        self.code_run = CodeRun.objects.get()
+
+    def test_get_svg(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': self.code_run.id})
+        with mock.patch.object(prov, '_run_dot', return_value=b'<svg/>') as run_dot:
+            response = client.get(url + '?format=svg')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b'<svg/>')
+            self.assertEqual(bytes(ProvReport.objects.get(code_run=self.code_run, format='svg').content), b'<svg/>')
+            cache.clear()
+            client.get(url + '?format=svg')
+        self.assertEqual(run_dot.call_count, 1)
+
+    def test_get_pending(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': self.code_run.id})
+        rendered = threading.Event()
+        release = threading.Event()
+
+        def run_dot(source, format):
+            release.wait(5)
+            rendered.set()
+            return b'<svg/>'
+
+        with mock.patch.object(prov, '_run_dot', run_dot), mock.patch.object(prov, 'IMAGE_RENDER_WAIT', 0.01):
+            response = client.get(url + '?format=svg')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response['Location'], 'http://testserver%s?format=svg' % url)
+            self.assertEqual(client.get(url + '?format=svg').status_code, 202)
+
+            release.set()
+            rendered.wait(5)
+            prov._render_pool.submit(lambda: None).result(5)
+            response = client.get(url + '?format=svg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'<svg/>')
+
+    def test_get_busy(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': self.code_run.id})
+        with mock.patch.object(prov, '_render_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = client.get(url + '?format=jpg')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    def test_get_too_large(self):
+        client = APIClient()
+        url = reverse('prov_report', kwargs={'pk': self.code_run.id})
+        with mock.patch.object(prov, 'IMAGE_MAX_RECORDS', 1):
+            response = client.get(url + '?format=jpg')
+        self.assertEqual(response.status_code, 400)
+
+
+class LineageAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='Test User')
+        init_db()
+
+    def _create_run(self, description, inputs=(), outputs=()):
+        code_run = CodeRun.objects.create(updated_by=self.user, run_date='2020-08-01T00:00:00Z',
+                                          description=description, submission_script=Object.objects.get(pk=1))
+        code_run.inputs.set(inputs)
+        code_run.outputs.set(outputs)
+        return code_run
+
+    def _create_component(self, object_id, name):
+        return ObjectComponent.objects.create(updated_by=self.user, object=Object.objects.get(pk=object_id), name=name)
+
+    def test_ancestors_and_descendants(self):
+        source = self._create_component(2, 'lineage-source')
+        middle = self._create_component(16, 'lineage-middle')
+        first = self._create_run('first', inputs=[source], outputs=[middle])
+        second = self._create_run('second', inputs=[middle], outputs=[self._create_component(3, 'lineage-result')])
+
+        client = APIClient()
+        response = client.get(reverse('object-ancestors', kwargs={'pk': 3}), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http://testserver/api/object/2/', response.json()['objects'])
+        self.assertIn('http://testserver/api/object/16/', response.json()['objects'])
+        self.assertTrue({'http://testserver/api/code_run/%d/' % run.id for run in (first, second)}
+                        .issubset(response.json()['code_runs']))
+
+        response = client.get(reverse('coderun-descendants', kwargs={'pk': first.id}), {'relations': 'id'},
+                              format='json')
+        self.assertEqual(response.json(), {'objects': [3, 16], 'code_runs': [second.id]})
+
+        second.inputs.remove(middle)
+        response = client.get(reverse('coderun-descendants', kwargs={'pk': first.id}), {'relations': 'id'},
+                              format='json')
+        self.assertEqual(response.json(), {'objects': [16], 'code_runs': []})
+
+    def test_lineage_not_found(self):
+        client = APIClient()
+        for pk in (999, 'abc'):
+            response = client.get(reverse('object-ancestors', kwargs={'pk': pk}), format='json')
+            self.assertEqual(response.status_code, 404)
+            response = client.get(reverse('coderun-descendants', kwargs={'pk': pk}), format='json')
+            self.assertEqual(response.status_code, 404)
+
+    def test_manifest_updates_lineage(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        existing = ObjectComponent.objects.get(pk=1)
+        data = {
+            'run_date': '2020-08-01T12:00:00Z',
+            'description': 'Manifest run',
+            'submission_script': 'http://testserver/api/object/1/',
+            'inputs': [{'object': 'http://testserver/api/object/%d/' % existing.object_id, 'name': existing.name}],
+            'outputs': [{'object': 'http://testserver/api/object/16/', 'name': 'lineage-output'}],
+        }
+        response = client.post(reverse('code_run_manifest'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        code_run = CodeRun.objects.get(description='Manifest run')
+
+        response = client.get(reverse('object-ancestors', kwargs={'pk': 16}), {'relations': 'id'}, format='json')
+        self.assertIn(existing.object_id, response.json()['objects'])
+        self.assertIn(code_run.id, response.json()['code_runs'])
+
+    def test_rebuild_lineage(self):
+        first = self._create_run('first', outputs=[self._create_component(16, 'lineage-middle')])
+        self._create_run('second', inputs=first.outputs.all())
+        links = set(LineageLink.objects.values_list('ancestor_type', 'ancestor_id', 'descendant_type',
+                                                    'descendant_id'))
+        LineageLink.objects.all().delete()
+        call_command('rebuild_lineage', stdout=StringIO())
+
+        self.assertTrue(links)
+        self.assertEqual(set(LineageLink.objects.values_list('ancestor_type', 'ancestor_id', 'descendant_type',
+                                                             'descendant_id')), links)
+
+    def test_issue_impact(self):
+        source = self._create_component(2, 'impact-source')
+        middle = self._create_component(16, 'impact-middle')
+        result = self._create_component(3, 'impact-result')
+        first = self._create_run('first', inputs=[source], outputs=[middle])
+        second = self._create_run('second', inputs=[middle], outputs=[result])
+        minor = Issue.objects.create(updated_by=self.user, severity=2, description='Minor impact issue')
+        minor.component_issues.set([middle])
+        major = Issue.objects.create(updated_by=self.user, severity=8, description='Major impact issue')
+        major.component_issues.set([source])
+
+        client = APIClient()
+        response = client.get(reverse('issue-impact', kwargs={'pk': minor.id}), {'relations': 'id'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertIn({'type': 'code_run', 'id': second.id, 'severity': 2}, results)
+        self.assertIn({'type': 'object_component', 'id': result.id, 'severity': 2}, results)
+        self.assertNotIn(first.id, [item['id'] for item in results if item['type'] == 'code_run'])
+
+        response = client.get(reverse('objectcomponent-impact', kwargs={'pk': middle.id}), format='json')
+        self.assertIn({'type': 'code_run', 'url': 'http://testserver/api/code_run/%d/' % second.id, 'severity': 2},
+                      response.json()['results'])
+
+        response = client.get(reverse('issue-impact', kwargs={'pk': major.id}), {'relations': 'id'}, format='json')
+        results = response.json()['results']
+        self.assertEqual(response.json()['count'], len(results))
+        for node in [('code_run', first.id), ('code_run', second.id), ('object_component', middle.id),
+                     ('object_component', result.id), ('object', 3)]:
+            self.assertIn({'type': node[0], 'id': node[1], 'severity': 8}, results)
+        self.assertEqual([item['severity'] for item in results],
+                         sorted((item['severity'] for item in results), reverse=True))
+
+    def test_issue_impact_paginated(self):
+        source = self._create_component(2, 'impact-source')
+        outputs = [self._create_component(16, 'impact-output-%d' % i) for i in range(3)]
+        self._create_run('first', inputs=[source], outputs=outputs)
+        issue = Issue.objects.create(updated_by=self.user, severity=5, description='Paginated impact issue')
+        issue.component_issues.set([source])
+
+        client = APIClient()
+        url = reverse('issue-impact', kwargs={'pk': issue.id})
+        results = []
+        with mock.patch.object(PageNumberPagination, 'page_size', 2):
+            page = client.get(url, {'relations': 'id'}, format='json').json()
+            results.extend(page['results'])
+            while page['next']:
+                page = client.get(page['next'], format='json').json()
+                self.assertLessEqual(len(page['results']), 2)
+                results.extend(page['results'])
+
+        # The run, its three outputs and the object of the outputs
+        self.assertEqual(page['count'], 5)
+        self.assertEqual(len(results), 5)
+        components = [item['id'] for item in results if item['type'] == 'object_component']
+        self.assertEqual(sorted(components), [output.id for output in outputs])
+
+    def test_issue_impact_not_found(self):
+        client = APIClient()
+        for pk in (999, 'abc'):
+            response = client.get(reverse('issue-impact', kwargs={'pk': pk}), format='json')
+            self.assertEqual(response.status_code, 404)
+
+    def test_invalid_query_arguments(self):
+        client = APIClient()
+        for url in (reverse('issue-impact', kwargs={'pk': 1}), reverse('object-ancestors', kwargs={'pk': 1}),
+                    reverse('coderun-descendants', kwargs={'pk': 1})):
+            self.assertEqual(client.get(url, {'relations': 'id'}, format='json').status_code, 200)
+            response = client.get(url, {'bogus': 1}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid query arguments', response.json()['detail'])
+
+
+class CodeRunManifestAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='Test User')
+        init_db()
+
+    def test_submit_manifest(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('code_run_manifest')
+        existing = ObjectComponent.objects.get(pk=1)
+        data = {
+            'run_date': '2020-08-01T12:00:00Z',
+            'description': 'Manifest run',
+            'submission_script_text': 'python run.py',
+            'inputs': [{'object': 'http://testserver/api/object/%d/' % existing.object_id, 'name': existing.name}],
+            'outputs': [
+                {'object': 'http://testserver/api/object/16/', 'name': 'output-%d' % i} for i in range(3)
+            ],
+        }
+        components = ObjectComponent.objects.count()
+        response = client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['inputs'], ['http://testserver/api/object_component/1/'])
+        self.assertEqual(len(response.json()['outputs']), 3)
+        self.assertEqual(ObjectComponent.objects.count(), components + 3)
+        code_run = CodeRun.objects.get(description='Manifest run')
+        self.assertEqual(code_run.submission_script.storage_location.storage_root.root,
+                         'https://data.scrc.uk/api/text_file/')
+        self.assertEqual(TextFile.objects.get(pk=int(code_run.submission_script.storage_location.path.split('/')[0]))
+                         .text, 'python run.py')
+
+    def test_submit_manifest_missing_object(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('code_run_manifest')
+        data = {
+            'run_date': '2020-08-01T12:00:00Z',
+            'description': 'Manifest run',
+            'submission_script': 'http://testserver/api/object/1/',
+            'outputs': [{'object': 'http://testserver/api/object/999/', 'name': 'output'}],
+        }
+        response = client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CodeRun.objects.filter(description='Manifest run').exists())
+
+    def test_submit_manifest_without_script(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('code_run_manifest')
+        response = client.post(url, {'run_date': '2020-08-01T12:00:00Z', 'description': 'Manifest run'},
+                               format='json')
+
+        self.assertEqual(response.status_code, 400)
+
 
 class SourceAPITests(TestCase):
 
@@ -704,6 +1546,77 @@ class NamespaceAPITests(TestCase):
         results = response.json()['results']
         self.assertEqual(len(results), 2)
 
+    def test_list_not_modified(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('namespace-list')
+        response = client.get(url, format='json')
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+        Namespace.objects.create(name='new-namespace', updated_by=self.user)
+        response = client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_not_modified_since(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('namespace-detail', kwargs={'pk': 1})
+        response = client.get(url, format='json')
+        last_modified = response['Last-Modified']
+
+        response = client.get(url, format='json', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = client.get(url, format='json', HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 2015 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_without_count_does_not_count(self):
+        client = APIClient()
+        url = reverse('namespace-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, {'count': 'false'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+
+    def test_detail_invalid_id(self):
+        client = APIClient()
+        response = client.get('/api/namespace/abc/', format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail_modified_in_same_second(self):
+        client = APIClient()
+        url = reverse('namespace-detail', kwargs={'pk': 1})
+        namespace = Namespace.objects.get(pk=1)
+        namespace.save()
+        last_modified = client.get(url, format='json')['Last-Modified']
+
+        # Last-Modified is rounded up, so a later change within the same second is not hidden by it
+        self.assertGreaterEqual(parse_http_date(last_modified), namespace.last_updated.timestamp())
+
+    def test_response_is_cached(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('namespace-list')
+        first = client.get(url, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            second = client.get(url, format='json')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(len(queries), 0)
+
+        namespace = Namespace.objects.get(pk=1)
+        namespace.name = 'renamed'
+        namespace.save()
+        response = client.get(url, format='json')
+        self.assertIn('renamed', [result['name'] for result in response.json()['results']])
+
 
 class DataProductAPITests(TestCase):
 
@@ -711,6 +1624,21 @@ class DataProductAPITests(TestCase):
         self.user = get_user_model().objects.create(username='Test User')
         init_db()
 
+    def test_cached_expand_sees_nested_changes(self):
+        client = APIClient()
+        data_product = DataProduct.objects.first()
+        url = reverse('dataproduct-detail', kwargs={'pk': data_product.id})
+        params = {'expand': 'object.storage_location'}
+        response = client.get(url, params, format='json')
+        self.assertEqual(response.json()['object']['storage_location']['path'],
+                         data_product.object.storage_location.path)
+
+        storage_location = data_product.object.storage_location
+        storage_location.path = 'path/to/moved/file'
+        storage_location.save()
+        response = client.get(url, params, format='json')
+        self.assertEqual(response.json()['object']['storage_location']['path'], 'path/to/moved/file')
+
     def test_get_list(self):
         client = APIClient()
         client.force_authenticate(user=self.user)
@@ -777,6 +1705,258 @@ class DataProductAPITests(TestCase):
         results = response.json()['results']
         self.assertEqual(len(results), 11)
 
+    def test_select_fields(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('dataproduct-list')
+        response = client.get(url, data={'fields': 'url,name,version'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 11)
+        self.assertEqual(set(results[0].keys()), {'url', 'name', 'version'})
+
+    def test_select_detail_fields(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('dataproduct-detail', kwargs={'pk': 1})
+        response = client.get(url, data={'fields': 'name'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'name': 'human/infection/SARS-CoV-2/symptom-probability'})
+
+    def test_select_invalid_field(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('dataproduct-list')
+        response = client.get(url, data={'fields': 'name,colour'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_expand(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('dataproduct-detail', kwargs={'pk': 1})
+        response = client.get(url, data={'expand': 'object.storage_location.storage_root,namespace'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['namespace']['name'], 'SCRC')
+        self.assertEqual(data['object']['storage_location']['storage_root']['name'], 'DataRepository')
+        self.assertEqual(data['object']['storage_location']['path'],
+                         'master/SCRC/human/infection/SARS-CoV-2/symptom-probability/0.1.0.toml')
+        self.assertEqual(data['object']['components'], ['http://testserver/api/object_component/1/'])
+
+    def test_expand_query_count(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('dataproduct-list')
+        data = {'expand': 'object.storage_location.storage_root,object.components,namespace', 'count': 'false'}
+        query_counts = []
+        for page_size in (2, 10):
+            cache.clear()
+            with mock.patch.object(CustomPagination, 'page_size', page_size):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url, data=data, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), page_size)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_expand_invalid_relation(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('dataproduct-list')
+        response = client.get(url, data={'expand': 'object.colour'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class RegisterDataProductAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='Test User')
+        init_db()
+
+    def _data(self, **kwargs):
+        data = {
+            'namespace': 'new-namespace',
+            'name': 'human/new-product',
+            'version': '0.1.0',
+            'storage_root': 'http://testserver/api/storage_root/2/',
+            'path': 'new/product/0.1.0.h5',
+            'hash': '0123456789abcdef0123456789abcdef01234567',
+            'components': [{'name': 'component-%d' % i} for i in range(5)],
+        }
+        data.update(kwargs)
+        return data
+
+    def test_register(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('register_data_product')
+        response = client.post(url, self._data(), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        data_product = DataProduct.objects.get(name='human/new-product', version='0.1.0')
+        self.assertEqual(response.json()['data_product'],
+                         'http://testserver/api/data_product/%d/' % data_product.id)
+        self.assertEqual(data_product.namespace.name, 'new-namespace')
+        self.assertEqual(data_product.object.storage_location.path, 'new/product/0.1.0.h5')
+        self.assertEqual(data_product.object.components.count(), 5)
+        self.assertEqual(len(response.json()['components']), 5)
+
+    def test_register_query_count(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('register_data_product')
+        query_counts = []
+        for version, components in (('0.1.0', 1), ('0.2.0', 50)):
+            data = self._data(namespace='SCRC', version=version, path='new/product/%s.h5' % version,
+                              components=[{'name': 'component-%d' % i} for i in range(components)])
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 201)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_register_existing_rolls_back(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('register_data_product')
+        data = self._data(namespace='SCRC', name='human/infection/SARS-CoV-2/symptom-probability')
+        objects = Object.objects.count()
+        response = client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Object.objects.count(), objects)
+        self.assertFalse(StorageLocation.objects.filter(path='new/product/0.1.0.h5').exists())
+
+    def test_register_invalid(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('register_data_product')
+        response = client.post(url, self._data(version='latest', components=[{'name': 'a'}, {'name': 'a'}]),
+                               format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json().keys()), {'version', 'components'})
+
+    def test_register_unauthenticated(self):
+        client = APIClient()
+        url = reverse('register_data_product')
+        response = client.post(url, self._data(), format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class ImportJobAPITests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='Test User')
+        init_db()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def _upload(self, client, name, lines, **data):
+        data['file'] = SimpleUploadedFile(name, '\n'.join(lines).encode('utf-8'))
+        return client.post(reverse('import_jobs'), data, format='multipart')
+
+    def test_import_jsonl(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        lines = [
+            json.dumps({'type': 'namespace', 'name': 'imported'}),
+            json.dumps({'type': 'namespace', 'name': 'SCRC'}),
+            'not json',
+            json.dumps({'type': 'storage_location', 'storage_root': 'http://testserver/api/storage_root/1/',
+                        'path': 'imported/file.h5', 'hash': '0123456789abcdef'}),
+        ]
+        response = self._upload(client, 'records.jsonl', lines)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertFalse(Namespace.objects.filter(name='imported').exists())
+
+        call_command('process_imports', once=True, stdout=StringIO())
+        response = client.get(response['Location'], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        job = response.json()
+        self.assertEqual(job['status'], 'complete')
+        self.assertEqual(job['rows_processed'], 4)
+        self.assertEqual(job['rows_failed'], 2)
+        self.assertEqual([error['row'] for error in job['errors']], [2, 3])
+        self.assertEqual(job['errors'][0]['errors'], {'detail': 'Field name must be unique'})
+        self.assertTrue(Namespace.objects.filter(name='imported', updated_by=self.user).exists())
+        self.assertTrue(StorageLocation.objects.filter(path='imported/file.h5').exists())
+
+    def test_import_csv_with_type(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = self._upload(client, 'namespaces.csv', ['name', 'imported-1', 'imported-2'], type='namespace')
+        self.assertEqual(response.status_code, 202)
+
+        call_command('process_imports', once=True, stdout=StringIO())
+        job = client.get(response['Location'], format='json').json()
+
+        self.assertEqual(job['status'], 'complete')
+        self.assertEqual((job['rows_processed'], job['rows_failed']), (2, 0))
+        self.assertEqual(Namespace.objects.filter(name__startswith='imported-').count(), 2)
+
+    def test_import_file_is_deleted(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        self._upload(client, 'namespaces.csv', ['name', 'imported'], type='namespace')
+        job = ImportJob.objects.get()
+        path = job.file.path
+        self.assertTrue(os.path.exists(path))
+
+        call_command('process_imports', once=True, stdout=StringIO())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(ImportJob.objects.get().file.name, '')
+
+    def test_stale_job_is_resumed(self):
+        lines = ['name', 'imported-1', 'imported-2', 'imported-3']
+        job = create_job(self.user, 'namespaces.csv', ContentFile('\n'.join(lines).encode('utf-8')),
+                         record_type='namespace')
+        job.status = ImportJob.RUNNING
+        job.rows_processed = 1
+        job.heartbeat = timezone.now()
+        job.save()
+
+        # A job that is still saving its progress is left to its worker
+        self.assertIsNone(claim_job())
+
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - STALE_JOB_TIMEOUT * 2)
+        call_command('process_imports', once=True, stdout=StringIO())
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, ImportJob.COMPLETE)
+        self.assertEqual(job.rows_processed, 3)
+        self.assertEqual(sorted(Namespace.objects.filter(name__startswith='imported-').values_list('name', flat=True)),
+                         ['imported-2', 'imported-3'])
+
+    def test_import_status_of_other_user(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = self._upload(client, 'records.jsonl', [json.dumps({'type': 'namespace', 'name': 'imported'})])
+
+        client.force_authenticate(user=get_user_model().objects.create(username='Other User'))
+        self.assertEqual(client.get(response['Location'], format='json').status_code, 404)
+
+    def test_import_invalid_type(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = self._upload(client, 'records.csv', ['name', 'imported'], type='nope')
+
+        self.assertEqual(response.status_code, 400)
+
 
 class CodeRepoReleaseAPITests(TestCase):
 
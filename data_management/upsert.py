@@ -0,0 +1,99 @@
+from django.db import connection, models, transaction
+
+from .generations import bump_generation
+
+
+def unique_fields(model):
+    """
+    Return the names of the fields identifying a row of the given model, taken from the first UniqueConstraint on the
+    model or otherwise the first unique field other than the primary key. Returns None if the model has neither.
+    """
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and constraint.condition is None:
+            return tuple(constraint.fields)
+    for field in model._meta.concrete_fields:
+        if field.unique and not field.primary_key:
+            return (field.name,)
+    return None
+
+
+def unique_violation(model, ex):
+    """
+    Return the name of the field which must be unique on its own that caused an IntegrityError when saving an object
+    of the given model, or None if no such field is identified in the database's error message.
+    """
+    message = str(ex)
+    opts = model._meta
+    names = [field.name for field in opts.concrete_fields if field.unique and not field.primary_key]
+    names += [constraint.fields[0] for constraint in opts.constraints
+              if isinstance(constraint, models.UniqueConstraint) and len(constraint.fields) == 1]
+    for name in names:
+        column = opts.get_field(name).column
+        # SQLite reports the table and column, PostgreSQL gives the column in the detail
+        if '%s.%s' % (opts.db_table, column) in message or 'Key (%s)=' % column in message:
+            return name
+    return None
+
+
+def upsert(model, attrs, update=False):
+    """
+    Create an object of the given model from the attributes, unless an object with the same values for the model's
+    unique_fields() already exists in which case that object is returned, after being updated with the attributes if
+    `update` is True. Returns the object and whether it was created.
+
+    On PostgreSQL this is done with a single INSERT ... ON CONFLICT statement, otherwise using get_or_create() or
+    update_or_create(). Many-to-many relations are only set on objects that are created or updated.
+    """
+    key = unique_fields(model)
+    if key is None:
+        raise ValueError('%s has no unique fields' % model.__name__)
+    attrs = dict(attrs)
+    many = {name: attrs.pop(name) for name in list(attrs) if model._meta.get_field(name).many_to_many}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            pk, created = _insert_on_conflict(model, attrs, key, update)
+            instance = model.objects.get(pk=pk)
+            if created or update:
+                bump_generation(model)
+        else:
+            lookup = {name: attrs.pop(name, None) for name in key}
+            get_or_create = model.objects.update_or_create if update else model.objects.get_or_create
+            instance, created = get_or_create(defaults=attrs, **lookup)
+        if created or update:
+            for name, values in many.items():
+                getattr(instance, name).set(values)
+    return instance, created
+
+
+def _insert_on_conflict(model, attrs, key, update):
+    """
+    Insert a row using INSERT ... ON CONFLICT, returning the id of the new or existing row and whether it was inserted.
+
+    When the row already exists the conflicting row is locked by a no-op update of its key (which is needed for
+    RETURNING to return it) or, if `update` is True, updated with the values given in `attrs` (along with who last
+    updated it and when), leaving its other columns as they are.
+    """
+    opts = model._meta
+    qn = connection.ops.quote_name
+    instance = model(**attrs)
+    fields = [field for field in opts.concrete_fields if not field.primary_key]
+    values = [field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields]
+    key_columns = [opts.get_field(name).column for name in key]
+    if update:
+        updated = set(opts.get_field(name).column for name in attrs)
+        updated.update(opts.get_field(name).column for name in ('last_updated', 'updated_by'))
+        updated_columns = [field.column for field in fields
+                           if field.column in updated and field.column not in key_columns]
+    else:
+        updated_columns = key_columns[:1]
+    sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s RETURNING %s, (xmax = 0)' % (
+        qn(opts.db_table),
+        ', '.join(qn(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+        ', '.join(qn(column) for column in key_columns),
+        ', '.join('%s = EXCLUDED.%s' % (qn(column), qn(column)) for column in updated_columns),
+        qn(opts.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        return cursor.fetchone()
@@ -4,8 +4,12 @@ from django.views.decorators.cache import cache_page
 from rest_framework import routers
 
 from . import views, models, tables
+from .generations import generation_cache_page, related_models
 from .rest import views as api_views
 
+# Pages showing registry data are cached until the data they show changes, or for at most a day
+CACHE_TIMEOUT = 60 * 60 * 24
+
 router = routers.DefaultRouter()
 router.register(r'users', api_views.UserViewSet)
 router.register(r'groups', api_views.GroupViewSet)
@@ -19,21 +23,31 @@ urlpatterns = [
     path('issues/', views.IssueListView.as_view(), name='issues'),
     path('issue/<int:pk>', views.IssueDetailView.as_view(), name='issue'),
     path('api/', include(router.urls)),
-    path('api/prov-report/<int:pk>/', cache_page(300)(api_views.ProvReportView.as_view()), name='prov_report'),
+    path('api/prov-report/<int:pk>/',
+         generation_cache_page(CACHE_TIMEOUT, list(models.all_models.values()))(api_views.ProvReportView.as_view()),
+         name='prov_report'),
+    path('api/code-run-manifest/', api_views.CodeRunManifestView.as_view(), name='code_run_manifest'),
+    path('api/register-data-product/', api_views.RegisterDataProductView.as_view(), name='register_data_product'),
+    path('api/import/', api_views.ImportJobListView.as_view(), name='import_jobs'),
+    path('api/import/<int:pk>/', api_views.ImportJobView.as_view(), name='import_job'),
     path('get-token', views.get_token, name='get_token'),
     path('revoke-token', views.revoke_token, name='revoke_token'),
     path('docs/', cache_page(300)(views.doc_index), name='docs_index'),
     path('docs/<str:name>', cache_page(300)(views.docs)),
-    path('tables/dataproducts', cache_page(300)(tables.data_product_table_data)),
-    path('tables/externalobjects', cache_page(300)(tables.external_objects_table_data)),
-    path('tables/codereporeleases', cache_page(300)(tables.code_repo_release_table_data)),
+    path('tables/dataproducts', generation_cache_page(CACHE_TIMEOUT, related_models(models.DataProduct))(
+        tables.data_product_table_data)),
+    path('tables/externalobjects', generation_cache_page(CACHE_TIMEOUT, related_models(models.ExternalObject))(
+        tables.external_objects_table_data)),
+    path('tables/codereporeleases', generation_cache_page(CACHE_TIMEOUT, related_models(models.CodeRepoRelease))(
+        tables.code_repo_release_table_data)),
     path('api/data/<path:name>', api_views.ObjectStorageView.as_view())
 ]
 
 
 for name in models.all_models:
     url_name = camel_case_to_spaces(name).replace(' ', '_')
-    urlpatterns.append(path(url_name + '/<int:pk>', cache_page(300)(getattr(views, name + 'DetailView').as_view()),
-                            name=name.lower()))
+    detail_view = generation_cache_page(CACHE_TIMEOUT, related_models(models.all_models[name], depth=2))(
+        getattr(views, name + 'DetailView').as_view())
+    urlpatterns.append(path(url_name + '/<int:pk>', detail_view, name=name.lower()))
     # urlpatterns.append(path(url_name + '/<int:pk>', getattr(views, name + 'DetailView').as_view(), name=name.lower()))
     urlpatterns.append(path(url_name + 's/', getattr(views, name + 'ListView').as_view(), name=name.lower() + 's')) 
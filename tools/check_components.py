@@ -11,6 +11,7 @@ DATA_PRODUCT_ENDPOINT = 'data_product/'
 NAMESPACE_ENDPOINT = 'namespace/'
 STORAGE_LOCATION_ENDPOINT = 'storage_location/'
 OBJECT_ENDPOINT = 'object/'
+OBJECT_COMPONENT_BATCH_ENDPOINT = 'object_component/batch/'
 
 
 def is_leaf(node):
@@ -89,14 +90,16 @@ def read_api(url, error_message):
 
 
 def get_component_names(component_urls):
-    names = []
-    for url in component_urls:
-        r = requests.get(url)
-        if r.status_code != 200:
-            raise Exception(r.content)
-        result = r.json()
-        names.append(result['name'])
-    return names
+    if not component_urls:
+        return []
+    url = API_ROOT + OBJECT_COMPONENT_BATCH_ENDPOINT + '?format=json&fields=name'
+    r = requests.post(url, json=component_urls)
+    if r.status_code != 200:
+        raise Exception(r.content)
+    data = r.json()
+    if data['missing']:
+        raise Exception('could not find components %s' % ', '.join(str(pk) for pk in data['missing']))
+    return [result['name'] for result in data['results']]
 
 
 def find_object_by_file_hash(file_hash, opts):